@@ -21,8 +21,10 @@ config = context.config
 fileConfig(config.config_file_name)
 
 # We'll create the engine directly instead of using the config
-# This avoids issues with special characters in the connection URL
-alembic_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# This avoids issues with special characters in the connection URL.
+# Migrations hold a single long-lived connection, so a one-shot CLI run
+# uses NullPool: no idle connections linger and no pre-ping is issued.
+alembic_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=pool.NullPool)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
@@ -37,10 +39,13 @@ def run_migrations_offline():
     """Run migrations in 'offline' mode."""
     # We can't use the URL from config because of special characters
     # So we'll use our database URL directly
+    # Inlining every parameter as a literal is only needed when generating a
+    # standalone SQL script, so it is opt-in via ALEMBIC_OFFLINE_SQL=1
+    literal_binds = os.getenv("ALEMBIC_OFFLINE_SQL") == "1"
     context.configure(
         url=SQLALCHEMY_DATABASE_URL,
         target_metadata=target_metadata,
-        literal_binds=True,
+        literal_binds=literal_binds,
         dialect_opts={"paramstyle": "named"},
     )
 
@@ -49,6 +54,32 @@ def run_migrations_offline():
 
 def run_migrations_online():
     """Run migrations in 'online' mode."""
+    # When invoked in-process by the API, reuse the connection it checked out
+    # from the application's already-warm pool
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        # The app engine sets a 30s statement_timeout for request queries, which would
+        # cancel table rewrites and index builds part way through (leaving an INVALID
+        # index behind after CREATE INDEX CONCURRENTLY). Lift it for the migration and
+        # restore it before the connection goes back to the pool; RESET returns to the
+        # value from the connection's startup options.
+        connection.exec_driver_sql("SET statement_timeout = 0")
+        connection.commit()
+        try:
+            context.configure(
+                connection=connection,
+                target_metadata=target_metadata
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            if connection.in_transaction():
+                connection.rollback()
+            connection.exec_driver_sql("RESET statement_timeout")
+            connection.commit()
+        return
+
     # Use our pre-configured engine instead of creating one from config
     with alembic_engine.connect() as connection:
         context.configure(
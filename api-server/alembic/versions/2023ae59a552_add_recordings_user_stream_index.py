@@ -0,0 +1,29 @@
+"""add_recordings_user_stream_index
+
+Revision ID: 2023ae59a552
+Revises: 7ee017a3e622
+Create Date: 2026-10-16 11:41:05.273918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2023ae59a552'
+down_revision = '7ee017a3e622'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_recordings_user_stream', 'recordings', ['user_id', 'stream_name'], unique=False)
+    
+    # created_at is only ever used as the sort key behind user_id or stream_name,
+    # which ix_recordings_user_created and ix_recordings_stream_created already cover
+    op.drop_index(op.f('ix_recordings_created_at'), table_name='recordings')
+
+
+def downgrade():
+    op.create_index(op.f('ix_recordings_created_at'), 'recordings', ['created_at'], unique=False)
+    op.drop_index('ix_recordings_user_stream', table_name='recordings')
@@ -8,8 +8,7 @@ Create Date: 2025-04-08 22:31:27.780102
 from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.dialects import postgresql
-import random
-import string
+import secrets
 
 
 # revision identifiers, used by Alembic.
@@ -20,8 +19,9 @@ depends_on = None
 
 
 def generate_stream_key():
-    """Generate a random 8-character alphanumeric string."""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    """Generate a random 8-character URL-safe string."""
+    # 6 random bytes encode to exactly 8 URL-safe base64 characters
+    return secrets.token_urlsafe(6)
 
 
 def upgrade():
@@ -31,14 +31,25 @@ def upgrade():
     # Create a temporary connection to execute SQL
     connection = op.get_bind()
     
-    # For each user, generate a new stream key
-    users = connection.execute(sa.text('SELECT id FROM users')).fetchall()
-    for user in users:
-        stream_key = generate_stream_key()
+    # Generate every user's stream key server-side in a single statement
+    op.execute(sa.text(
+        'UPDATE users SET stream_key = '
+        'substr(md5(random()::text || id::text || clock_timestamp()::text), 1, 8)'
+    ))
+    
+    # Re-key any rows that collided until every stream key is unique,
+    # sending all replacement keys in a single executemany per pass
+    duplicates_query = sa.text(
+        'SELECT id FROM users WHERE stream_key IN '
+        '(SELECT stream_key FROM users GROUP BY stream_key HAVING COUNT(*) > 1)'
+    )
+    duplicate_ids = connection.execute(duplicates_query).scalars().all()
+    while duplicate_ids:
         connection.execute(
             sa.text('UPDATE users SET stream_key = :key WHERE id = :id'),
-            parameters=dict(key=stream_key, id=user[0])
+            [dict(key=generate_stream_key(), id=user_id) for user_id in duplicate_ids]
         )
+        duplicate_ids = connection.execute(duplicates_query).scalars().all()
     
     # Make stream_key not nullable after data migration
     op.alter_column('users', 'stream_key',
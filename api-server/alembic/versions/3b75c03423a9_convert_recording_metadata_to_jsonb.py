@@ -0,0 +1,34 @@
+"""convert_recording_metadata_to_jsonb
+
+Revision ID: 3b75c03423a9
+Revises: 2023ae59a552
+Create Date: 2026-10-16 12:02:47.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3b75c03423a9'
+down_revision = '2023ae59a552'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # jsonb is stored pre-parsed, so reads no longer re-parse the text on every access
+    op.alter_column('recordings', 'recording_metadata',
+                    existing_type=sa.JSON(),
+                    type_=postgresql.JSONB(astext_type=sa.Text()),
+                    existing_nullable=True,
+                    postgresql_using='recording_metadata::jsonb')
+
+
+def downgrade():
+    op.alter_column('recordings', 'recording_metadata',
+                    existing_type=postgresql.JSONB(astext_type=sa.Text()),
+                    type_=sa.JSON(),
+                    existing_nullable=True,
+                    postgresql_using='recording_metadata::json')
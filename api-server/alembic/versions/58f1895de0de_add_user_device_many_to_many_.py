@@ -4,9 +4,16 @@ Revision ID: 58f1895de0de
 Revises: 98dd9d2a76ee
 Create Date: 2025-04-18 08:06:21.243120
 
+The device/user copy commits batch by batch (see upgrade), so this revision is not
+atomic: if a later step fails, the association table and the rows copied so far stay
+committed while alembic_version is not advanced. The upgrade is written to be re-run
+in that state: the table is only created if missing, copying resumes after the last
+device already copied, and rows that already exist are skipped.
+
 """
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import table, column, select
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -21,15 +28,19 @@ depends_on = None
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
     try:
-        # Create the new association table
-        op.create_table('user_device_association',
-            sa.Column('user_id', sa.Integer(), nullable=False),
-            sa.Column('device_id', sa.Integer(), nullable=False),
-            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
-            sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
-            sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
-            sa.PrimaryKeyConstraint('user_id', 'device_id')
-        )
+        connection = op.get_bind()
+
+        # Create the new association table, unless an earlier failed run already
+        # committed it along with its first batches
+        if not sa.inspect(connection).has_table('user_device_association'):
+            op.create_table('user_device_association',
+                sa.Column('user_id', sa.Integer(), nullable=False),
+                sa.Column('device_id', sa.Integer(), nullable=False),
+                sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+                sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+                sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                sa.PrimaryKeyConstraint('user_id', 'device_id')
+            )
 
         # Create SQLAlchemy table objects for the migration
         devices = table('devices',
@@ -37,41 +48,69 @@ def upgrade():
             column('user_id', sa.Integer)
         )
 
-        connection = op.get_bind()
-        
+        user_device_assoc = table('user_device_association',
+            column('user_id', sa.Integer),
+            column('device_id', sa.Integer)
+        )
+
         # Get all existing device-user relationships
         # Wrap in a try block in case the query fails
         try:
-            device_users = connection.execute(
-                select(devices.c.id, devices.c.user_id).where(devices.c.user_id.isnot(None))
-            ).fetchall()
+            # Page through devices by primary key so memory stays bounded by the batch size.
+            # Each batch commits on its own, which would close a server-side cursor,
+            # so keyset pagination is used instead of streaming a single result.
+            batch_size = 1000
+            if connection.dialect.name == 'postgresql':
+                # A re-run may overlap rows an earlier run already committed
+                insert_stmt = postgresql.insert(user_device_assoc).on_conflict_do_nothing()
+            else:
+                insert_stmt = sa.insert(user_device_assoc)
+            # Batches are committed in device id order, so everything up to the highest
+            # device already copied is done; resume after it
+            last_id = connection.execute(
+                select(sa.func.coalesce(sa.func.max(user_device_assoc.c.device_id), 0))
+            ).scalar()
+            while True:
+                rows = op.get_bind().execute(
+                    select(devices.c.id, devices.c.user_id)
+                    .where(devices.c.user_id.isnot(None), devices.c.id > last_id)
+                    .order_by(devices.c.id)
+                    .limit(batch_size)
+                ).fetchall()
+                if not rows:
+                    break
 
-            # Insert the relationships into the new association table
-            if device_users:
-                # Insert in batches to avoid memory issues
-                batch_size = 1000
-                for i in range(0, len(device_users), batch_size):
-                    batch = device_users[i:i + batch_size]
-                    op.bulk_insert(
-                        table('user_device_association',
-                            column('user_id', sa.Integer),
-                            column('device_id', sa.Integer),
-                            column('created_at', sa.DateTime(timezone=True))
-                        ),
-                        [{'user_id': user_id, 'device_id': device_id} 
-                         for device_id, user_id in batch]
+                # Insert the relationships into the new association table, one executemany
+                # INSERT per batch committed immediately so WAL and locks are released as we go;
+                # created_at uses its server default
+                with op.get_context().autocommit_block():
+                    op.get_bind().execute(
+                        insert_stmt,
+                        [{'user_id': user_id, 'device_id': device_id} for device_id, user_id in rows]
                     )
+
+                last_id = rows[-1][0]
         except SQLAlchemyError as e:
             print(f"Error during data migration: {str(e)}")
             raise
 
         # Remove the old foreign key and column
         # First check if the constraint exists
-        inspector = sa.inspect(connection)
-        for fk in inspector.get_foreign_keys('devices'):
-            if fk['referred_table'] == 'users':
-                op.drop_constraint(fk['name'], 'devices', type_='foreignkey')
-                break
+        if connection.dialect.name == 'postgresql':
+            # Look the constraint up with a single catalog query
+            fk_name = connection.execute(sa.text(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = 'devices'::regclass AND contype = 'f' "
+                "AND confrelid = 'users'::regclass LIMIT 1"
+            )).scalar()
+            if fk_name:
+                op.drop_constraint(fk_name, 'devices', type_='foreignkey')
+        else:
+            inspector = sa.inspect(connection)
+            for fk in inspector.get_foreign_keys('devices'):
+                if fk['referred_table'] == 'users':
+                    op.drop_constraint(fk['name'], 'devices', type_='foreignkey')
+                    break
 
         op.drop_column('devices', 'user_id')
 
@@ -104,13 +143,34 @@ def downgrade():
             
             # Update devices table with the first user for each device
             if device_users:
-                for device_id, user_id in device_users:
-                    connection.execute(
-                        sa.text('UPDATE devices SET user_id = :user_id WHERE id = :device_id AND user_id IS NULL'),
-                        user_id=user_id,
-                        device_id=device_id
-                    )
-        
+                if connection.dialect.name == 'postgresql':
+                    # One UPDATE ... FROM (VALUES ...) statement per chunk instead of one per row
+                    chunk_size = 5000
+                    for i in range(0, len(device_users), chunk_size):
+                        chunk = device_users[i:i + chunk_size]
+                        values = ", ".join(
+                            f"(CAST(:device_id_{n} AS INTEGER), CAST(:user_id_{n} AS INTEGER))"
+                            for n in range(len(chunk))
+                        )
+                        params = {}
+                        for n, (device_id, user_id) in enumerate(chunk):
+                            params[f"device_id_{n}"] = device_id
+                            params[f"user_id_{n}"] = user_id
+                        connection.execute(
+                            sa.text(
+                                f'UPDATE devices SET user_id = v.user_id '
+                                f'FROM (VALUES {values}) AS v(device_id, user_id) '
+                                f'WHERE devices.id = v.device_id AND devices.user_id IS NULL'
+                            ),
+                            params
+                        )
+                else:
+                    for device_id, user_id in device_users:
+                        connection.execute(
+                            sa.text('UPDATE devices SET user_id = :user_id WHERE id = :device_id AND user_id IS NULL'),
+                            dict(user_id=user_id, device_id=device_id)
+                        )
+
             # Make the column non-nullable after data migration
             op.alter_column('devices', 'user_id', nullable=False)
             
@@ -0,0 +1,27 @@
+"""add_devices_stream_key_hash_index
+
+Revision ID: 6701d4307361
+Revises: 3b75c03423a9
+Create Date: 2026-10-16 12:31:19.804462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6701d4307361'
+down_revision = '3b75c03423a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # stream_key is only ever matched by equality (device lookups on every RTMP
+    # handshake), which a hash index serves without walking a btree.
+    # ix_devices_stream_key stays in place since it enforces uniqueness.
+    op.create_index('ix_devices_stream_key_hash', 'devices', ['stream_key'], unique=False, postgresql_using='hash')
+
+
+def downgrade():
+    op.drop_index('ix_devices_stream_key_hash', table_name='devices')
@@ -0,0 +1,36 @@
+"""add_device_lookup_indexes
+
+Revision ID: 7ee017a3e622
+Revises: d82016df072b
+Create Date: 2026-10-16 10:03:27.114689
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7ee017a3e622'
+down_revision = 'd82016df072b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The (user_id, device_id) primary key only serves lookups by user_id,
+    # so index device_id for joins coming from the devices side
+    op.create_index('ix_uda_device_id', 'user_device_association', ['device_id'], unique=False)
+    
+    # Access checks only ever match active devices, so keep a smaller partial index for them
+    op.create_index(
+        'ix_devices_stream_key_active',
+        'devices',
+        ['stream_key'],
+        unique=False,
+        postgresql_where=sa.text('is_active')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_devices_stream_key_active', table_name='devices')
+    op.drop_index('ix_uda_device_id', table_name='user_device_association')
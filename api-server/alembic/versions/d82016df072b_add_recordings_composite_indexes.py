@@ -0,0 +1,28 @@
+"""add_recordings_composite_indexes
+
+Revision ID: d82016df072b
+Revises: 2f40b47c801e
+Create Date: 2026-10-16 09:12:40.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd82016df072b'
+down_revision = '2f40b47c801e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Recordings are always listed newest-first, so index the filter column
+    # together with created_at DESC to turn ORDER BY ... LIMIT into a range scan
+    op.create_index('ix_recordings_user_created', 'recordings', ['user_id', sa.text('created_at DESC')], unique=False)
+    op.create_index('ix_recordings_stream_created', 'recordings', ['stream_name', sa.text('created_at DESC')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_recordings_stream_created', table_name='recordings')
+    op.drop_index('ix_recordings_user_created', table_name='recordings')
@@ -0,0 +1,30 @@
+"""add_recordings_metadata_stream_id_index
+
+Revision ID: f2073cbafddb
+Revises: 6701d4307361
+Create Date: 2026-10-16 13:14:52.067713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2073cbafddb'
+down_revision = '6701d4307361'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stream recordings are looked up by the stream_id stored in the metadata
+    op.create_index(
+        'ix_recordings_metadata_stream_id',
+        'recordings',
+        [sa.text("(recording_metadata ->> 'stream_id')")],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_recordings_metadata_stream_id', table_name='recordings')
@@ -1,6 +1,32 @@
-from sqlalchemy.orm import Session
+import json
+from datetime import datetime
+from sqlalchemy import BigInteger, and_, cast, func, insert, lambda_stmt, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
 from . import models, schemas
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+def recording_query(recording_id: int, user_id: Optional[int] = None):
+    """
+    Build the query for a recording by ID. If user_id is provided, the recording is
+    only matched when the user has access to it through their devices.
+    """
+    # If no user_id provided, just match the recording
+    if user_id is None:
+        return select(models.Recording).where(models.Recording.id == recording_id)
+        
+    # Match the recording only if the user has an active device with a matching
+    # stream key, joining through the association table in a single query
+    return select(models.Recording).join(
+        models.Device, models.Device.stream_key == models.Recording.stream_name
+    ).join(
+        models.user_device_association,
+        models.user_device_association.c.device_id == models.Device.id
+    ).where(
+        models.Recording.id == recording_id,
+        models.user_device_association.c.user_id == user_id,
+        models.Device.is_active.is_(True)
+    ).limit(1)
 
 def get_recording(db: Session, recording_id: int, user_id: Optional[int] = None):
     """
@@ -14,47 +40,197 @@ def get_recording(db: Session, recording_id: int, user_id: Optional[int] = None)
     Returns:
         Recording if found and user has access, None otherwise
     """
-    # First get the recording
-    recording = db.query(models.Recording).filter(
-        models.Recording.id == recording_id
-    ).first()
+    return db.execute(recording_query(recording_id, user_id)).scalars().first()
+
+async def get_recording_async(db: AsyncSession, recording_id: int, user_id: Optional[int] = None):
+    """Async counterpart of get_recording."""
+    return (await db.execute(recording_query(recording_id, user_id))).scalars().first()
+
+def get_recording_with_access(db: Session, recording_id: int, user_id: int) -> Tuple[Optional[models.Recording], bool]:
+    """
+    Get a recording by ID together with whether the user may access it, in one query.
     
-    if not recording:
-        return None
-        
-    # If no user_id provided, just return the recording
-    if user_id is None:
-        return recording
-        
-    # Check if user has access through device association
-    user_device = db.query(models.Device).filter(
-        models.Device.users.any(id=user_id),
-        models.Device.is_active == True,
-        models.Device.stream_key == recording.stream_name
-    ).first()
+    A user has access if they own the recording, or if one of their active devices
+    has a stream key matching the recording's stream name or metadata stream_id.
     
-    # Return recording only if user has an associated device with matching stream key
-    return recording if user_device else None
-
-def get_recordings(db: Session, user_id: int, skip: int = 0, limit: int = 100, stream_name: Optional[str] = None):
-    # Get all devices associated with the user
-    user_devices = db.query(models.Device).join(models.Device.users).filter(models.User.id == user_id).all()
+    Returns:
+        Tuple of (recording or None if it does not exist, has_access)
+    """
+    device_access = select(models.Device.id).join(
+        models.user_device_association,
+        models.user_device_association.c.device_id == models.Device.id
+    ).where(
+        models.user_device_association.c.user_id == user_id,
+        models.Device.is_active.is_(True),
+        or_(
+            models.Device.stream_key == models.Recording.stream_name,
+            models.Device.stream_key == models.Recording.recording_metadata["stream_id"].astext
+        )
+    ).exists()
     
-    # Get all stream keys from the user's devices
-    stream_keys = [device.stream_key for device in user_devices]
+    row = db.execute(
+        select(
+            models.Recording,
+            or_(models.Recording.user_id == user_id, device_access).label("has_access")
+        ).where(models.Recording.id == recording_id)
+    ).first()
     
-    # Base query for recordings
-    query = db.query(models.Recording)
+    if row is None:
+        return None, False
+    return row.Recording, bool(row.has_access)
+
+def recordings_query(
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    stream_name: Optional[str] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    summary: bool = False
+):
+    """
+    Build the query for a page of the recordings the user can access through their devices.
     
-    # Filter by stream keys if we have any devices
-    if stream_keys:
-        query = query.filter(models.Recording.stream_name.in_(stream_keys))
+    With summary=True only the schemas.RecordingSummary columns are loaded, which
+    leaves out the JSONB metadata and file paths.
+    """
+    # Recordings whose stream name matches one of the user's devices, in one query.
+    # Built as a lambda statement so the compiled SQL is cached across requests
+    # and only the bound values change per call.
+    stmt = lambda_stmt(lambda: select(models.Recording).join(
+        models.Device, models.Device.stream_key == models.Recording.stream_name
+    ).join(
+        models.user_device_association,
+        models.user_device_association.c.device_id == models.Device.id
+    ).where(
+        models.user_device_association.c.user_id == user_id
+    ))
     
     # Additional stream name filter if provided
     if stream_name:
-        query = query.filter(models.Recording.stream_name == stream_name)
+        stmt += lambda s: s.where(models.Recording.stream_name == stream_name)
+    
+    if summary:
+        stmt += lambda s: s.options(load_only(
+            models.Recording.id,
+            models.Recording.stream_name,
+            models.Recording.created_at,
+            models.Recording.file_size,
+            models.Recording.duration,
+            models.Recording.environment
+        ))
     
-    return query.order_by(models.Recording.created_at.desc()).offset(skip).limit(limit).all()
+    # Keyset pagination: continue after the (created_at, id) of the previous page's
+    # last row, which walks the index instead of scanning and discarding OFFSET rows
+    if after:
+        after_created_at, after_id = after
+        stmt += lambda s: s.where(
+            tuple_(models.Recording.created_at, models.Recording.id) < tuple_(after_created_at, after_id)
+        )
+    elif skip:
+        stmt += lambda s: s.offset(skip)
+    
+    stmt += lambda s: s.order_by(models.Recording.created_at.desc(), models.Recording.id.desc()).limit(limit)
+    
+    return stmt
+
+def get_recordings(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    stream_name: Optional[str] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    summary: bool = False
+):
+    return db.execute(recordings_query(user_id, skip, limit, stream_name, after, summary)).scalars().all()
+
+async def get_recordings_async(
+    db: AsyncSession,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    stream_name: Optional[str] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    summary: bool = False
+):
+    """Async counterpart of get_recordings."""
+    result = await db.execute(recordings_query(user_id, skip, limit, stream_name, after, summary))
+    return result.scalars().all()
+
+def get_stream_recordings(
+    db: Session,
+    user_id: int,
+    stream_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Tuple[datetime, int]] = None
+):
+    """
+    Get the user's recordings belonging to the stream get_streams reports as stream_id.
+    
+    A recording belongs to the stream named by its metadata stream_id, or by its
+    stream name when it has none, so listings agree with the per-stream counts.
+    """
+    metadata_stream_id = models.Recording.recording_metadata["stream_id"].astext
+    stmt = select(models.Recording).join(
+        models.Device, models.Device.stream_key == models.Recording.stream_name
+    ).join(
+        models.user_device_association,
+        models.user_device_association.c.device_id == models.Device.id
+    ).where(
+        models.user_device_association.c.user_id == user_id,
+        # Spelled out rather than as coalesce(...) = :stream_id so each branch
+        # can use the metadata stream_id and stream_name indexes
+        or_(
+            metadata_stream_id == stream_id,
+            and_(metadata_stream_id.is_(None), models.Recording.stream_name == stream_id)
+        )
+    ).order_by(
+        models.Recording.created_at.desc(), models.Recording.id.desc()
+    ).limit(limit)
+    
+    if after:
+        stmt = stmt.where(tuple_(models.Recording.created_at, models.Recording.id) < tuple_(*after))
+    elif skip:
+        stmt = stmt.offset(skip)
+    
+    return db.execute(stmt).scalars().all()
+
+def get_streams(db: Session, user_id: int):
+    """
+    Summarize the user's recordings per stream.
+    
+    Recordings are grouped by their metadata stream_id, falling back to the
+    stream name, and aggregated in the database so only one row per stream
+    is returned.
+    """
+    stream_id = func.coalesce(
+        models.Recording.recording_metadata["stream_id"].astext,
+        models.Recording.stream_name
+    ).label("stream_id")
+    
+    stmt = select(
+        stream_id,
+        func.min(models.Recording.stream_name).label("stream_name"),
+        func.count().label("recording_count"),
+        func.min(models.Recording.created_at).label("first_recording"),
+        func.max(models.Recording.created_at).label("latest_recording"),
+        # SUM over bigint yields numeric; cast back so the driver returns an int, not a Decimal
+        cast(func.sum(models.Recording.file_size), BigInteger).label("total_size")
+    ).join(
+        models.Device, models.Device.stream_key == models.Recording.stream_name
+    ).join(
+        models.user_device_association,
+        models.user_device_association.c.device_id == models.Device.id
+    ).where(
+        models.user_device_association.c.user_id == user_id
+    ).group_by(
+        stream_id
+    ).order_by(
+        func.max(models.Recording.created_at).desc()
+    )
+    
+    return [dict(row) for row in db.execute(stmt).mappings()]
 
 def create_recording(db: Session, recording: schemas.RecordingCreate):
     db_recording = models.Recording(**recording.dict())
@@ -63,6 +239,43 @@ def create_recording(db: Session, recording: schemas.RecordingCreate):
     db.refresh(db_recording)
     return db_recording
 
+# Batches at least this large are loaded with COPY instead of INSERT
+BULK_COPY_THRESHOLD = 100
+
+RECORDING_COPY_COLUMNS = (
+    "stream_name", "local_mp4_path", "s3_mp4_path", "local_hls_path", "s3_hls_path",
+    "file_size", "duration", "environment", "recording_metadata", "user_id"
+)
+
+def bulk_create_recordings(db: Session, recordings: List[schemas.RecordingCreate]) -> int:
+    """
+    Insert many recordings in one statement.
+    
+    Small batches use a multi-row INSERT; large ones are streamed through
+    PostgreSQL's COPY, which skips per-row statement overhead entirely.
+    
+    Returns:
+        Number of recordings inserted
+    """
+    if not recordings:
+        return 0
+    
+    if len(recordings) < BULK_COPY_THRESHOLD:
+        db.execute(insert(models.Recording), [recording.dict() for recording in recordings])
+    else:
+        columns = ", ".join(RECORDING_COPY_COLUMNS)
+        dbapi_connection = db.connection().connection
+        with dbapi_connection.cursor() as cursor:
+            with cursor.copy(f"COPY recordings ({columns}) FROM STDIN") as copy:
+                for recording in recordings:
+                    row = recording.dict()
+                    if row["recording_metadata"] is not None:
+                        row["recording_metadata"] = json.dumps(row["recording_metadata"])
+                    copy.write_row([row[column] for column in RECORDING_COPY_COLUMNS])
+    
+    db.commit()
+    return len(recordings)
+
 def update_recording(db: Session, recording_id: int, recording: schemas.RecordingCreate, user_id: int):
     db_recording = db.query(models.Recording).filter(
         models.Recording.id == recording_id,
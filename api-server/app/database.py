@@ -1,4 +1,7 @@
-from sqlalchemy import create_engine
+from contextvars import ContextVar
+from typing import List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -29,7 +32,7 @@ if ENVIRONMENT.lower() == "aws":
     logger.info(f"Connecting to AWS PostgreSQL at {POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}")
     
     # Use explicit TCP connection with escaped password
-    SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{escaped_password}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require"
+    SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg://{POSTGRES_USER}:{escaped_password}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require"
 else:
     # Use local PostgreSQL configuration
     POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
@@ -39,25 +42,50 @@ else:
     POSTGRES_DB = os.getenv("POSTGRES_DB", "recordings")
     
     # Use explicit TCP connection for local development
-    SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-# Connection pool size configuration
-POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
-MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+# Connection pool size configuration. Each uvicorn worker process gets its own
+# pools, so split the connection budget across WEB_CONCURRENCY workers. Within a
+# worker the budget is shared by the sync and async engines: most handlers are sync,
+# so the async engine gets a fifth of it and the sync engine the rest. Each engine
+# may overflow by half its pool size, as before the split.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_CONNECTION_BUDGET = max(5, 50 // WEB_CONCURRENCY)
+ASYNC_POOL_SIZE = max(1, int(os.getenv("DB_ASYNC_POOL_SIZE", str(DB_CONNECTION_BUDGET // 5))))
+ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", str(ASYNC_POOL_SIZE // 2)))
+POOL_SIZE = max(2, int(os.getenv("DB_POOL_SIZE", str(DB_CONNECTION_BUDGET - ASYNC_POOL_SIZE))))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(POOL_SIZE // 2)))
 POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
 POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
 
-# Create SQLAlchemy engine with optimized connection pooling and TCP-specific settings
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=os.getenv("SQL_ECHO", "false").lower() == "true",  # Only enable SQL logging when explicitly set
-    pool_pre_ping=True,  # Enable connection health checks
-    pool_size=POOL_SIZE,  # Number of connections to keep open
-    max_overflow=MAX_OVERFLOW,  # Allow creating more connections when under load
+# Number of compiled SQL statements cached per engine (SQLAlchemy default is 500)
+QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+# SQL statement logging is costly per query, so only enable it when explicitly set
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+if not SQL_ECHO:
+    # Keep any INFO-level root configuration from emitting per-statement output
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+# Per-request SQL statement counting, used to catch N+1 query regressions during
+# development. Enabled by default only in the local environment.
+SQL_QUERY_GUARD = os.getenv("SQL_QUERY_GUARD", str(ENVIRONMENT.lower() == "local")).lower() == "true"
+SQL_QUERY_LIMIT = int(os.getenv("SQL_QUERY_LIMIT", "10"))
+# Fail the offending statement instead of only logging once the limit is passed
+SQL_QUERY_LIMIT_STRICT = os.getenv("SQL_QUERY_LIMIT_STRICT", "false").lower() == "true"
+
+# Engine options shared by the sync and async engines; pool sizes are set per engine
+ENGINE_OPTIONS = dict(
+    echo=SQL_ECHO,
+    query_cache_size=QUERY_CACHE_SIZE,  # Reuse compiled SQL across requests
+    pool_pre_ping=True,  # Enable connection health checks; wait_for_db relies on dead connections being replaced
     pool_recycle=POOL_RECYCLE,  # Recycle connections after 1 hour
     pool_timeout=POOL_TIMEOUT,  # Time to wait for a connection from pool
+    pool_use_lifo=True,  # Reuse the most recently returned (warmest) connection
+    use_insertmanyvalues=True,  # Batch multi-row INSERTs into single statements
     connect_args={
         "application_name": "api-server",  # Helps identify connections in pg_stat_activity
+        "prepare_threshold": 5,  # Use server-side prepared statements for repeated queries
         "keepalives": 1,
         "keepalives_idle": 30,
         "keepalives_interval": 10,
@@ -66,6 +94,14 @@ engine = create_engine(
     }
 )
 
+# Create SQLAlchemy engine with optimized connection pooling and TCP-specific settings
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=POOL_SIZE,  # Number of connections to keep open
+    max_overflow=MAX_OVERFLOW,  # Allow creating more connections when under load
+    **ENGINE_OPTIONS
+)
+
 # Create SessionLocal class with optimized settings
 SessionLocal = sessionmaker(
     autocommit=False, 
@@ -74,6 +110,44 @@ SessionLocal = sessionmaker(
     expire_on_commit=False  # Improve performance by not expiring objects after commit
 )
 
+# Async engine for handlers running on the event loop. psycopg 3 speaks asyncio
+# natively, so the same URL and driver are used; awaiting queries releases the
+# event loop instead of blocking it for the duration of each round trip.
+async_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    **ENGINE_OPTIONS
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# Statement count for the current request, set by QueryCountMiddleware. The value is a
+# one-element list rather than an int because sync handlers run in a copy of the
+# request's context on a worker thread, where set() would not be seen by the middleware.
+sql_query_count: ContextVar[Optional[List[int]]] = ContextVar("sql_query_count", default=None)
+
+class QueryLimitExceeded(RuntimeError):
+    """Raised when a request executes more than SQL_QUERY_LIMIT statements in strict mode."""
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = sql_query_count.get()
+    if counter is None:
+        return
+    counter[0] += 1
+    if SQL_QUERY_LIMIT_STRICT and counter[0] > SQL_QUERY_LIMIT:
+        raise QueryLimitExceeded(
+            f"Request executed more than {SQL_QUERY_LIMIT} SQL statements; next was: {statement}"
+        )
+
+if SQL_QUERY_GUARD:
+    event.listen(engine, "before_cursor_execute", _count_query)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _count_query)
+
 # Create Base class
 Base = declarative_base()
 
@@ -83,4 +157,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Dependency to get an async database session
+async def get_async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
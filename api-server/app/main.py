@@ -1,13 +1,21 @@
 import os
+import random
 import time
 from fastapi import FastAPI, HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import http_exception_handler, request_validation_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from .routers import recordings, users, stream, devices
 from . import models
-from .database import engine, SQLALCHEMY_DATABASE_URL
+from .database import (
+    engine, async_engine, SQLALCHEMY_DATABASE_URL, QUERY_CACHE_SIZE, POOL_SIZE, MAX_OVERFLOW,
+    SQL_QUERY_GUARD, SQL_QUERY_LIMIT, sql_query_count
+)
 import boto3
 import logging
 import asyncio
+import anyio.to_thread
 from contextlib import asynccontextmanager
 from alembic.config import Config
 from alembic import command
@@ -15,34 +23,40 @@ from alembic.runtime import migration
 from alembic.script import ScriptDirectory
 from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import sys
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Log records are handed to a queue on the calling thread and written to stdout
+# by a background listener, so request handlers never block on stream I/O
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout), respect_handler_level=True)
+log_listener.start()
 
 # Configure logging to output to stdout with a more straightforward configuration
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler(sys.stdout)
+        QueueHandler(log_queue)
     ],
     force=True  # Force reconfiguration of the root logger
 )
 
-# Create logger for this module
+# Create logger for this module. Records propagate to the root queue handler,
+# so no handlers are attached here (that would write every line twice).
 logger = logging.getLogger("api")
 # Set the log level for this logger
 logger.setLevel(logging.INFO)
-# Ensure all handlers propagate logs to stdout
-for handler in logging.root.handlers:
-    if isinstance(handler, logging.StreamHandler) and handler.stream == sys.stdout:
-        logger.addHandler(handler)
 
-def wait_for_db(max_retries=30, retry_interval=1):
-    """Wait for the database to be ready with exponential backoff"""
+def wait_for_db(timeout=60, retry_interval=1):
+    """Wait for the database to be ready with jittered exponential backoff"""
+    deadline = time.monotonic() + timeout
     retries = 0
-    while retries < max_retries:
+    while True:
         try:
             # Try to establish a connection and run a simple query
             with engine.connect() as connection:
@@ -50,29 +64,45 @@ def wait_for_db(max_retries=30, retry_interval=1):
                 logger.info("Successfully connected to the database")
                 return True
         except OperationalError as e:
-            wait_time = retry_interval * (2 ** retries)  # Exponential backoff
-            wait_time = min(wait_time, 10)  # Cap at 10 seconds
-            logger.warning(f"Database not ready yet (attempt {retries + 1}/{max_retries}). Retrying in {wait_time} seconds...")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Full jitter keeps workers that start together from retrying in lockstep
+            wait_time = random.uniform(0, min(retry_interval * (2 ** retries), 5))
+            wait_time = min(wait_time, remaining)
+            logger.warning(f"Database not ready yet (attempt {retries + 1}). Retrying in {wait_time:.2f} seconds...")
             time.sleep(wait_time)
             retries += 1
     
-    raise Exception("Could not connect to the database after maximum retries")
+    raise Exception(f"Could not connect to the database within {timeout} seconds")
+
+def prepare_alembic():
+    """Load the Alembic configuration and resolve the head revision (file I/O only, no DB)"""
+    # Create Alembic configuration
+    alembic_cfg = Config("alembic.ini")
+    
+    # Get the migration script directory
+    script = ScriptDirectory.from_config(alembic_cfg)
+    
+    # Get the current head revision
+    head_revision = script.get_current_head()
+    return alembic_cfg, head_revision
 
-def run_migrations_sync():
+def apply_alembic(alembic_cfg, head_revision):
     """Run database migrations using Alembic"""
     try:
         logger.info("Running database migrations...")
-        # Create Alembic configuration
-        alembic_cfg = Config("alembic.ini")
-        
-        # Get the migration script directory
-        script = ScriptDirectory.from_config(alembic_cfg)
         
-        # Get the current head revision
-        head_revision = script.get_current_head()
-        
-        # Run the migration
-        with engine.begin() as connection:
+        # Run the migration. Alembic manages the transaction itself so that
+        # revisions can commit in batches via autocommit_block().
+        with engine.connect() as connection:
+            # Skip the upgrade entirely on the common restart path where nothing changed
+            current_revision = migration.MigrationContext.configure(connection).get_current_revision()
+            connection.rollback()
+            if current_revision == head_revision:
+                logger.info(f"Database already at head revision {head_revision}; skipping upgrade")
+                return
+            
             alembic_cfg.attributes['connection'] = connection
             command.upgrade(alembic_cfg, "head")
             
@@ -83,118 +113,177 @@ def run_migrations_sync():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Wait for database to be ready and run migrations in a separate thread
+    # Wait for database to be ready and run migrations in a separate thread.
+    # Alembic config parsing overlaps with the database connection retries.
+    loop = asyncio.get_event_loop()
     try:
-        await asyncio.get_event_loop().run_in_executor(None, wait_for_db)
-        await asyncio.get_event_loop().run_in_executor(None, run_migrations_sync)
+        _, (alembic_cfg, head_revision) = await asyncio.gather(
+            loop.run_in_executor(None, wait_for_db),
+            loop.run_in_executor(None, prepare_alembic)
+        )
+        await loop.run_in_executor(None, apply_alembic, alembic_cfg, head_revision)
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
+        log_listener.stop()
         raise
-    yield
+    logger.info(
+        "Database pool size: %s (async: %s), compiled query cache size: %s",
+        engine.pool.size(), async_engine.pool.size(), QUERY_CACHE_SIZE
+    )
+    # anyio's worker threads run sync route handlers, but also FileResponse and
+    # range-response file reads, S3 calls and the sync auth dependencies of async
+    # routes, none of which hold a pooled connection. Keep anyio's default of 40 so
+    # segment delivery is not throttled by the pool size; only raise it when the sync
+    # pool could serve more handlers at once than that.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, POOL_SIZE + MAX_OVERFLOW)
+    try:
+        yield
+    finally:
+        # Close pooled async connections while the event loop is still running
+        await async_engine.dispose()
+        # Flush any queued log records before the worker exits
+        log_listener.stop()
+
+# Paths hit by health probes several times a second; logging them only adds noise
+UNLOGGED_PATHS = frozenset(("/", "/health"))
 
 # Add request logging middleware
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware for logging request/response details and error messages"""
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
-        # Log directly to stdout in addition to logger
-        print(f"API REQUEST: {request.method} {request.url.path}")
-        
-        # Get the real client IP from X-Forwarded-For if available
-        client_host = request.headers.get("x-forwarded-for", request.client.host)
-        # Get query parameters if any
-        query_params = dict(request.query_params)
-        query_str = f" - Query: {query_params}" if query_params else ""
-        
-        # Log request with more details
-        log_message = (
-            f">>> Request: {request.method} {request.url.path}{query_str} "
-            f"- Client: {client_host}"
-        )
-        logger.info(log_message)
-        print(log_message)  # Direct stdout logging as backup
+class RequestLoggingMiddleware:
+    """
+    Pure ASGI middleware for logging request/response details and error messages.
+    Wraps only `send` to observe the response, so responses are never buffered
+    or rebuilt and streaming bodies pass straight through.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Load balancer probes are passed straight through without instrumentation
+        if scope["type"] != "http" or scope["path"] in UNLOGGED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        method = scope["method"]
+        path = scope["path"]
         
-        try:
-            # Process request and get response
-            response = await call_next(request)
-            
-            # Calculate processing time
-            process_time = time.time() - start_time
-            
-            # Check if it's an error response (4xx or 5xx status code)
-            if response.status_code >= 400:
-                # For error responses, try to capture the response body
-                response_body = b""
-                async for chunk in response.body_iterator:
-                    response_body += chunk
-                
-                # Try to decode the response body
-                try:
-                    body_text = response_body.decode()
-                except UnicodeDecodeError:
-                    body_text = "[Binary response body]"
-                
-                # Log error response with body content
-                log_response = (
-                    f"<<< Error Response: {request.method} {request.url.path} "
-                    f"- Status: {response.status_code} "
-                    f"- Time: {process_time:.3f}s "
-                    f"- Body: {body_text}"
-                )
-                logger.error(log_response)
-                print(log_response)  # Direct stdout logging as backup
-                
-                # Create a new response with the same body
-                return Response(
-                    content=response_body,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type=response.media_type
-                )
+        # Only build the request details when INFO records will actually be emitted
+        if logger.isEnabledFor(logging.INFO):
+            request = Request(scope)
+            # Get the real client IP from X-Forwarded-For if available; only the
+            # first entry is the originating client, the rest are proxies
+            forwarded_for = request.headers.get("x-forwarded-for")
+            if forwarded_for:
+                client_host = forwarded_for.split(",", 1)[0].strip()
             else:
-                # Log successful response
-                log_response = (
-                    f"<<< Response: {request.method} {request.url.path} "
-                    f"- Status: {response.status_code} "
-                    f"- Time: {process_time:.3f}s"
-                )
-                logger.info(log_response)
-                print(log_response)  # Direct stdout logging as backup
-            
-            return response
+                client = scope.get("client")
+                client_host = client[0] if client else "-"
+            # Get query parameters if any
+            query_params = dict(request.query_params)
+            query_str = f" - Query: {query_params}" if query_params else ""
             
+            # Log request with more details
+            logger.info(">>> Request: %s %s%s - Client: %s", method, path, query_str, client_host)
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            # Process request
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
             # Log error response
-            process_time = time.time() - start_time
-            log_error = (
-                f"!!! Error: {request.method} {request.url.path} "
-                f"- Error: {str(e)} "
-                f"- Type: {type(e).__name__} "
-                f"- Time: {process_time:.3f}s"
+            process_time = time.perf_counter() - start_time
+            logger.error(
+                "!!! Error: %s %s - Error: %s - Type: %s - Time: %.3fs",
+                method, path, e, type(e).__name__, process_time
             )
-            logger.error(log_error)
-            print(log_error)  # Direct stdout logging as backup
             
             # Log exception details for debugging
             import traceback
             error_traceback = traceback.format_exc()
-            logger.error(f"Traceback: {error_traceback}")
-            print(f"Traceback: {error_traceback}")  # Direct stdout logging as backup
+            logger.error("Traceback: %s", error_traceback)
             
             raise
 
+        # Calculate processing time
+        process_time = time.perf_counter() - start_time
+        
+        # Check if it's an error response (4xx or 5xx status code). The error
+        # detail itself is logged by the exception handlers below.
+        if status_code >= 400:
+            logger.error(
+                "<<< Error Response: %s %s - Status: %s - Time: %.3fs",
+                method, path, status_code, process_time
+            )
+        else:
+            # Log successful response
+            logger.info(
+                "<<< Response: %s %s - Status: %s - Time: %.3fs",
+                method, path, status_code, process_time
+            )
+
+class QueryCountMiddleware:
+    """
+    Pure ASGI middleware counting the SQL statements each request executes and
+    warning when a request goes over SQL_QUERY_LIMIT, which usually means a
+    relationship is being loaded once per row.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        counter = [0]
+        token = sql_query_count.set(counter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sql_query_count.reset(token)
+            if counter[0] > SQL_QUERY_LIMIT:
+                logger.warning(
+                    "!!! %s %s executed %s SQL statements (limit %s)",
+                    scope["method"], scope["path"], counter[0], SQL_QUERY_LIMIT
+                )
+
 # Create FastAPI app
 app = FastAPI(
     title="RTMP Recording API",
     description="API for managing RTMP recordings",
     version="1.0.0",
     lifespan=lifespan,
+    # orjson encodes considerably faster than the stdlib json used by JSONResponse;
+    # included routers inherit this default
+    default_response_class=ORJSONResponse,
 )
 
 # Add request logging middleware
 app.add_middleware(RequestLoggingMiddleware)
 
+# Count SQL statements per request during development
+if SQL_QUERY_GUARD:
+    app.add_middleware(QueryCountMiddleware)
+
+# Log error details where they are already materialized instead of reading response bodies
+@app.exception_handler(StarletteHTTPException)
+async def log_http_exception(request: Request, exc: StarletteHTTPException):
+    logger.error("HTTP error on %s %s - Status: %s - Detail: %s", request.method, request.url.path, exc.status_code, exc.detail)
+    return await http_exception_handler(request, exc)
+
+@app.exception_handler(RequestValidationError)
+async def log_validation_exception(request: Request, exc: RequestValidationError):
+    logger.error("Validation error on %s %s - Errors: %s", request.method, request.url.path, exc.errors())
+    return await request_validation_exception_handler(request, exc)
+
 # Configure CORS
 # Configure CORS only for local development
 if os.getenv("ENVIRONMENT", "local").lower() == "local":
@@ -216,6 +305,9 @@ app.include_router(devices.router)
 def read_root():
     return {"message": "Welcome to the RTMP Recording API"}
 
+# The health payload never changes, so encode it once
+_HEALTH_BODY = ORJSONResponse({"status": "healthy"}).body
+
 @app.get("/health")
-def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+async def health_check():
+    return Response(content=_HEALTH_BODY, media_type="application/json")
\ No newline at end of file
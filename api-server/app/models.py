@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, BigInteger, JSON, Boolean, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, DateTime, Text, BigInteger, Boolean, ForeignKey, Table, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -10,6 +11,7 @@ user_device_association = Table(
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("device_id", Integer, ForeignKey("devices.id"), primary_key=True),
     Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_uda_device_id", "device_id"),
 )
 
 class Recording(Base):
@@ -21,16 +23,23 @@ class Recording(Base):
     s3_mp4_path = Column(String(1024), nullable=True)
     local_hls_path = Column(String(1024), nullable=True)
     s3_hls_path = Column(String(1024), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     file_size = Column(BigInteger, nullable=True)
     duration = Column(Integer, nullable=True)
     environment = Column(String(50), nullable=False)
-    recording_metadata = Column(JSON, nullable=True)
+    recording_metadata = Column(JSONB, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Relationship with User model
-    owner = relationship("User", back_populates="recordings")
+    owner = relationship("User", back_populates="recordings", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_recordings_user_created", "user_id", created_at.desc()),
+        Index("ix_recordings_stream_created", "stream_name", created_at.desc()),
+        Index("ix_recordings_user_stream", "user_id", "stream_name"),
+        Index("ix_recordings_metadata_stream_id", recording_metadata["stream_id"].astext),
+    )
 
 class Device(Base):
     __tablename__ = "devices"
@@ -44,7 +53,12 @@ class Device(Base):
     is_active = Column(Boolean, default=True)
     
     # Updated relationship with User model to be many-to-many
-    users = relationship("User", secondary=user_device_association, back_populates="devices")
+    users = relationship("User", secondary=user_device_association, back_populates="devices", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_devices_stream_key_active", "stream_key", postgresql_where=is_active),
+        Index("ix_devices_stream_key_hash", "stream_key", postgresql_using="hash"),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -57,6 +71,8 @@ class User(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     auth0_id = Column(String(255), unique=True, index=True)
     
-    # Relationships
-    recordings = relationship("Recording", back_populates="owner")
-    devices = relationship("Device", secondary=user_device_association, back_populates="users") 
\ No newline at end of file
+    # Relationships. These refuse to lazy-load so that any access has to be
+    # eager-loaded at the query site (e.g. with selectinload) instead of
+    # silently issuing one query per user.
+    recordings = relationship("Recording", back_populates="owner", lazy="raise_on_sql")
+    devices = relationship("Device", secondary=user_device_association, back_populates="users", lazy="raise_on_sql") 
\ No newline at end of file
@@ -1,56 +1,70 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
 from sqlalchemy.exc import IntegrityError
 from typing import List
-import secrets
-import string
 
-from ..database import get_db
-from ..models import Device, User
+from ..database import get_async_db
+from ..models import Device, User, user_device_association
 from ..schemas import DeviceCreate, Device as DeviceSchema, DeviceList, DeviceUpdate
 from ..services.auth import auth_service
+from ..utils.stream_keys import generate_stream_key
 
 router = APIRouter(
     prefix="/devices",
     tags=["devices"]
 )
 
-def generate_stream_key(length: int = 8) -> str:
-    """Generate a random stream key."""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+# Response fields read straight off the Device model; user_id is supplied by the caller
+DEVICE_FIELDS = tuple(field for field in DeviceSchema.__fields__ if field != "user_id")
+
+def to_device_schema(device: Device, user_id: int) -> DeviceSchema:
+    """Build the response model from the device's column attributes."""
+    return DeviceSchema(
+        user_id=user_id,  # For schema compatibility
+        **{field: getattr(device, field) for field in DEVICE_FIELDS}
+    )
+
+async def get_user_device(db: AsyncSession, device_id: int, user_id: int):
+    """Get a device if it is linked to the user, via a primary key hit on the association table."""
+    result = await db.execute(
+        select(Device)
+        .join(user_device_association, user_device_association.c.device_id == Device.id)
+        .where(
+            Device.id == device_id,
+            user_device_association.c.user_id == user_id
+        )
+    )
+    return result.scalar_one_or_none()
 
 @router.post("/", response_model=DeviceSchema)
 async def create_device(
     device: DeviceCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(auth_service.get_admin_user)
 ):
     """Create a new device. Admin only."""
-    db_device = Device(
-        name=device.name,
-        stream_key=generate_stream_key(),
-        is_active=True
-    )
-    
     try:
-        # Add device to db
-        db.add(db_device)
-        db.flush()
-        
-        # Add relationship to current user
-        db_device.users.append(current_user)
+        # Insert the device and read back its server defaults in one statement
+        result = await db.execute(
+            insert(Device)
+            .values(name=device.name, stream_key=generate_stream_key(), is_active=True)
+            .returning(Device)
+        )
+        db_device = result.scalar_one()
         
-        db.commit()
-        db.refresh(db_device)
+        # Add relationship to current user. current_user belongs to the auth
+        # dependency's session, so link it by id rather than through the relationship.
+        await db.execute(
+            insert(user_device_association).values(user_id=current_user.id, device_id=db_device.id)
+        )
         
-        # Construct response
-        response = dict(db_device.__dict__)
-        response["user_id"] = current_user.id  # For schema compatibility
+        await db.commit()
         
-        return response
+        return to_device_schema(db_device, current_user.id)
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Error creating device. Please try again."
@@ -60,38 +74,49 @@ async def create_device(
 async def get_devices(
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
     """Get all devices for the authenticated user."""
-    devices = db.query(Device).filter(
-        Device.users.contains(current_user)
-    ).offset(skip).limit(limit).all()
+    # Fetch the page and the total in one round trip; the window count is
+    # computed over the full filtered set before OFFSET/LIMIT apply
+    result = await db.execute(
+        select(Device, func.count().over().label("total"))
+        .options(raiseload("*"))  # Responses only use column attributes
+        .join(user_device_association, user_device_association.c.device_id == Device.id)
+        .where(user_device_association.c.user_id == current_user.id)
+        .order_by(Device.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = result.all()
     
-    total_count = db.query(Device).filter(
-        Device.users.contains(current_user)
-    ).count()
+    devices = [row.Device for row in rows]
+    if rows:
+        total_count = rows[0].total
+    elif skip:
+        # Paged past the end, so no row carried the total
+        result = await db.execute(
+            select(func.count())
+            .select_from(user_device_association)
+            .where(user_device_association.c.user_id == current_user.id)
+        )
+        total_count = result.scalar_one()
+    else:
+        total_count = 0
     
-    # Add user_id for schema compatibility
-    device_list = []
-    for device in devices:
-        device_dict = dict(device.__dict__)
-        device_dict["user_id"] = current_user.id
-        device_list.append(device_dict)
+    device_list = [to_device_schema(device, current_user.id) for device in devices]
     
     return DeviceList(devices=device_list, count=total_count)
 
 @router.get("/{device_id}", response_model=DeviceSchema)
 async def get_device(
     device_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
     """Get a specific device by ID."""
-    device = db.query(Device).filter(
-        Device.id == device_id,
-        Device.users.contains(current_user)
-    ).first()
+    device = await get_user_device(db, device_id, current_user.id)
     
     if not device:
         raise HTTPException(
@@ -99,24 +124,17 @@ async def get_device(
             detail="Device not found"
         )
     
-    # Add user_id for schema compatibility
-    response = dict(device.__dict__)
-    response["user_id"] = current_user.id
-    
-    return response
+    return to_device_schema(device, current_user.id)
 
 @router.put("/{device_id}", response_model=DeviceSchema)
 async def update_device(
     device_id: int,
     device_update: DeviceUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
     """Update a device."""
-    device = db.query(Device).filter(
-        Device.id == device_id,
-        Device.users.contains(current_user)
-    ).first()
+    device = await get_user_device(db, device_id, current_user.id)
     
     if not device:
         raise HTTPException(
@@ -128,16 +146,12 @@ async def update_device(
         setattr(device, field, value)
     
     try:
-        db.commit()
-        db.refresh(device)
+        await db.commit()
+        await db.refresh(device)
         
-        # Add user_id for schema compatibility
-        response = dict(device.__dict__)
-        response["user_id"] = current_user.id
-        
-        return response
+        return to_device_schema(device, current_user.id)
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Error updating device. Please try again."
@@ -146,26 +160,31 @@ async def update_device(
 @router.delete("/{device_id}")
 async def delete_device(
     device_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(auth_service.get_admin_user)
 ):
     """Delete a device. Admin only."""
-    device = db.query(Device).filter(
-        Device.id == device_id,
-        Device.users.contains(current_user)
-    ).first()
+    # Only existence matters here, so fetch the id rather than the whole row
+    result = await db.execute(
+        select(Device.id)
+        .join(user_device_association, user_device_association.c.device_id == Device.id)
+        .where(
+            Device.id == device_id,
+            user_device_association.c.user_id == current_user.id
+        )
+    )
     
-    if not device:
+    if result.scalar_one_or_none() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Device not found"
         )
     
-    # Remove device from all related users
-    device.users = []
+    # Remove device from all related users, without loading the users collection first
+    await db.execute(delete(user_device_association).where(user_device_association.c.device_id == device_id))
     
     # Delete the device
-    db.delete(device)
-    db.commit()
+    await db.execute(delete(Device).where(Device.id == device_id))
+    await db.commit()
     
     return {"message": "Device deleted successfully"} 
\ No newline at end of file
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Response, Request
-from fastapi.responses import StreamingResponse, FileResponse, RedirectResponse, JSONResponse
+from fastapi.responses import StreamingResponse, FileResponse, RedirectResponse, JSONResponse, ORJSONResponse
+from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple, Tuple
 from .. import crud, schemas, database
 import boto3
 import os
 import io
+import shutil
+import stat
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import subprocess
@@ -15,12 +20,14 @@ import logging
 import requests
 import time
 import urllib.parse
-from app.models import User, Device
+import asyncio
+from app.models import User, Device, Recording, user_device_association
 
-from ..utils.video import process_video_for_streaming, get_video_info
-from ..utils.s3 import get_s3_client, generate_presigned_url, download_from_s3, get_s3_hls_file_url
+from ..utils.video import process_video_for_streaming, get_video_info, get_h264_encoder, get_h264_bitrate_args, get_hwaccel_args
+from ..utils.s3 import get_s3_client, generate_presigned_url, download_from_s3, get_s3_hls_file_url, get_s3_hls_playlist
+from ..utils.pagination import decode_cursor, next_cursor
 from app.services.auth import auth_service
-from app.services.video_processor import check_task_exists
+from app.services.video_processor import check_task_exists, claim_failed_processing, submit_processing_job
 
 load_dotenv()
 
@@ -32,9 +39,124 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Templates are parsed once and compiled templates are reused across requests.
+# They only change on deploy, so skip Jinja's per-render mtime check of the file.
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates"))
+templates.env.auto_reload = False
+
 RECORDINGS_DIR = "/recordings"
 HLS_DIR = os.path.join(RECORDINGS_DIR, "hls")
 
+# When the API runs behind nginx, local HLS files can be handed off to it with
+# X-Accel-Redirect instead of being read through Python. Set this to the prefix of
+# an internal nginx location aliased to RECORDINGS_DIR, e.g. "/protected-recordings/"
+# for `location /protected-recordings/ { internal; alias /recordings/; }`.
+HLS_ACCEL_REDIRECT_PREFIX = os.getenv("HLS_ACCEL_REDIRECT_PREFIX")
+
+class HLSLocation(NamedTuple):
+    """Where a recording's HLS files are served from."""
+    environment: str
+    s3_hls_path: Optional[str]
+    local_hls_path: Optional[str]
+
+# Short-lived cache of HLS locations by recording ID. Players request a new segment
+# every few seconds, and once a recording has HLS paths they no longer change.
+# The caches in this module are per worker process: forget_hls_location only clears
+# the worker handling the update or delete, so other workers keep serving the old
+# location for up to HLS_LOCATION_CACHE_TTL afterwards. Cached access grants (see
+# _access_granted) expire the same way.
+HLS_LOCATION_CACHE_TTL = 60
+HLS_LOCATION_CACHE_MAX_ENTRIES = 10000
+_hls_location_cache: Dict[int, Tuple[float, HLSLocation]] = {}
+
+def get_hls_location(db: Session, recording_id: int) -> Optional[HLSLocation]:
+    """Get the HLS location of a recording, or None if the recording does not exist."""
+    cached = _hls_location_cache.get(recording_id)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    
+    # Only the path columns are needed, so skip loading the metadata document
+    row = db.execute(
+        select(Recording.environment, Recording.s3_hls_path, Recording.local_hls_path)
+        .where(Recording.id == recording_id)
+    ).first()
+    if row is None:
+        return None
+    
+    location = HLSLocation(*row)
+    # Only cache once processing has produced paths, so a finished recording is picked up immediately
+    if location.s3_hls_path or location.local_hls_path:
+        if len(_hls_location_cache) >= HLS_LOCATION_CACHE_MAX_ENTRIES:
+            _hls_location_cache.clear()
+        _hls_location_cache[recording_id] = (time.monotonic() + HLS_LOCATION_CACHE_TTL, location)
+    return location
+
+# Local HLS directories recently seen to contain a playlist. Players reload the
+# stream and status endpoints repeatedly during startup; a finished playlist does
+# not go away, so a positive check is remembered instead of re-stat'ing the file.
+_hls_playlist_seen: Dict[Tuple[int, str], float] = {}
+
+def local_hls_playlist_exists(recording_id: int, hls_path: str) -> bool:
+    """Whether playlist.m3u8 exists in a recording's local HLS directory."""
+    key = (recording_id, hls_path)
+    expires_at = _hls_playlist_seen.get(key)
+    if expires_at is not None and expires_at > time.monotonic():
+        return True
+    
+    if not os.path.isfile(os.path.join(hls_path, "playlist.m3u8")):
+        return False
+    # Missing playlists are not remembered, so one finishing processing is seen at once
+    if len(_hls_playlist_seen) >= HLS_LOCATION_CACHE_MAX_ENTRIES:
+        _hls_playlist_seen.clear()
+    _hls_playlist_seen[key] = time.monotonic() + HLS_LOCATION_CACHE_TTL
+    return True
+
+# Recently granted (user_id, recording_id) access checks. Opening a recording calls
+# the stream endpoint and then fetches the playlist, and players re-fetch the playlist
+# on reload or error recovery; each of these would otherwise repeat the device join.
+# Denials are not remembered, and grants expire with the TTL so revoked device access
+# takes effect within a minute.
+_access_granted: Dict[Tuple[int, int], float] = {}
+
+def has_cached_access(user_id: int, recording_id: int) -> bool:
+    """Whether the user was recently found to have access to the recording."""
+    expires_at = _access_granted.get((user_id, recording_id))
+    return expires_at is not None and expires_at > time.monotonic()
+
+def remember_access(user_id: int, recording_id: int) -> None:
+    """Record that the user has access to the recording."""
+    if len(_access_granted) >= HLS_LOCATION_CACHE_MAX_ENTRIES:
+        _access_granted.clear()
+    _access_granted[(user_id, recording_id)] = time.monotonic() + HLS_LOCATION_CACHE_TTL
+
+# Payloads of recently verified playlist tokens. A player presents the same token
+# each time it fetches the playlist, so its signature is checked once per TTL.
+TOKEN_CACHE_TTL = 30
+_verified_tokens: Dict[str, Tuple[float, dict]] = {}
+
+def verify_playlist_token(token: str) -> dict:
+    """Verify a temporary playlist token, reusing a recent verification of the same token."""
+    cached = _verified_tokens.get(token)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    
+    payload = auth_service.verify_temporary_token(token)
+    # Never keep a payload past the token's own expiry
+    ttl = min(TOKEN_CACHE_TTL, payload["exp"] - time.time())
+    if ttl > 0:
+        if len(_verified_tokens) >= HLS_LOCATION_CACHE_MAX_ENTRIES:
+            _verified_tokens.clear()
+        _verified_tokens[token] = (time.monotonic() + ttl, payload)
+    return payload
+
+def forget_hls_location(recording_id: int) -> None:
+    """Drop cached HLS state for a recording whose paths changed or that was deleted."""
+    _hls_location_cache.pop(recording_id, None)
+    for key in [key for key in _hls_playlist_seen if key[0] == recording_id]:
+        _hls_playlist_seen.pop(key, None)
+    for key in [key for key in _access_granted if key[1] == recording_id]:
+        _access_granted.pop(key, None)
+
 # Add a background task processor for HLS conversion - KEEPING THIS FOR BACKWARDS COMPATIBILITY
 async def process_recording_background(recording_id: int, db: Session):
     """
@@ -74,7 +196,7 @@ async def process_recording_background(recording_id: int, db: Session):
             # Process video for HLS streaming
             logger.info(f"Processing local video for streaming: {file_path}")
             try:
-                playlist_path, video_info = process_video_for_streaming(file_path, hls_output_dir)
+                playlist_path, video_info = await asyncio.to_thread(process_video_for_streaming, file_path, hls_output_dir)
                 logger.info(f"HLS playlist created at: {playlist_path}")
             except Exception as e:
                 logger.error(f"Failed to process video for streaming: {str(e)}")
@@ -97,7 +219,8 @@ async def process_recording_background(recording_id: int, db: Session):
                 logger.info(f"Downloading from S3: {s3_path}")
                 
                 try:
-                    if not download_from_s3(s3_path, temp_file.name):
+                    # Run the blocking S3 download off the event loop
+                    if not await asyncio.to_thread(download_from_s3, s3_path, temp_file.name):
                         logger.error("Failed to download file from S3")
                         update_transcoding_status(db, db_recording, "failed", "Error downloading from S3")
                         return
@@ -109,7 +232,7 @@ async def process_recording_background(recording_id: int, db: Session):
                 # Process video for HLS streaming
                 logger.info(f"Processing S3 video for streaming: {temp_file.name}")
                 try:
-                    playlist_path, video_info = process_video_for_streaming(temp_file.name, hls_output_dir)
+                    playlist_path, video_info = await asyncio.to_thread(process_video_for_streaming, temp_file.name, hls_output_dir)
                     logger.info(f"HLS playlist created at: {playlist_path}")
                 except Exception as e:
                     logger.error(f"Failed to process S3 video: {str(e)}")
@@ -141,10 +264,10 @@ async def process_recording_background(recording_id: int, db: Session):
         logger.error(f"Unexpected error in background processing task: {str(e)}")
         try:
             # Try to update status to failed
-            db_recording = db.query(models.Recording).filter(models.Recording.id == recording_id).first()
+            db_recording = db.query(Recording).filter(Recording.id == recording_id).first()
             if db_recording:
                 update_transcoding_status(db, db_recording, "failed", f"Unexpected error: {str(e)}")
-        except:
+        except Exception:
             logger.error("Could not update failure status in database")
 
 def update_transcoding_status(db: Session, recording, status: str, error_message: str = None):
@@ -167,24 +290,110 @@ def update_transcoding_status(db: Session, recording, status: str, error_message
         logger.error(f"Failed to update transcoding status: {str(e)}")
         db.rollback()
 
+# Read size when streaming part of a local HLS file for a Range request. Segments
+# are MPEG-TS, a sequence of 188-byte packets, so reads are a whole number of
+# packets (348 x 188 = 65424 bytes, just under 64 KiB) and players requesting
+# packet-aligned ranges never receive a packet split across chunks.
+MPEG_TS_PACKET_SIZE = 188
+HLS_CHUNK_PACKETS = int(os.getenv("HLS_CHUNK_PACKETS", "348"))
+RANGE_CHUNK_SIZE = MPEG_TS_PACKET_SIZE * HLS_CHUNK_PACKETS
+
+def parse_byte_range(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" Range header into inclusive (start, end) offsets.
+    
+    Returns None when the header is absent or not a single byte range, in which
+    case the whole file is served. Raises a 416 HTTPException if the range
+    cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(file_size - int(end_str), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+    end = min(end, file_size - 1)
+    if start > end or start >= file_size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
+def iter_file_range(file_path: str, start: int, end: int):
+    """Yield the bytes of file_path from start to end inclusive in fixed-size chunks."""
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# Recording response fields, all plain column attributes on the Recording model
+RECORDING_FIELDS = tuple(schemas.Recording.__fields__)
+RECORDING_SUMMARY_FIELDS = tuple(schemas.RecordingSummary.__fields__)
+
+# Upper bound on page sizes for recording lists
+MAX_PAGE_SIZE = 500
+
+def to_recording_dicts(recordings: List[Recording], fields: Tuple[str, ...] = RECORDING_FIELDS) -> List[Dict[str, Any]]:
+    """
+    Convert recordings to plain dicts for list responses.
+    
+    The rows come straight from the database and already match the schema, so
+    list endpoints hand these to ORJSONResponse directly instead of validating
+    each row through pydantic and walking it again with jsonable_encoder.
+    """
+    return [{field: getattr(recording, field) for field in fields} for recording in recordings]
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Decode a pagination cursor query parameter, rejecting malformed ones with a 400."""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/", response_model=schemas.RecordingList)
-def read_recordings(
+async def read_recordings(
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), 
     stream_name: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, regex="^summary$", description="Set to 'summary' to return only list-view columns"),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
-    recordings = crud.get_recordings(db, user_id=current_user.id, skip=skip, limit=limit, stream_name=stream_name)
-    return {"recordings": recordings, "count": len(recordings)}
+    summary = fields == "summary"
+    recordings = await crud.get_recordings_async(
+        db, user_id=current_user.id, skip=skip, limit=limit, stream_name=stream_name,
+        after=parse_cursor(cursor), summary=summary
+    )
+    return ORJSONResponse({
+        "recordings": to_recording_dicts(recordings, RECORDING_SUMMARY_FIELDS if summary else RECORDING_FIELDS),
+        "count": len(recordings),
+        "next_cursor": next_cursor(recordings, limit)
+    })
 
 @router.get("/{recording_id}", response_model=schemas.Recording)
-def read_recording(
+async def read_recording(
     recording_id: int, 
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
-    db_recording = crud.get_recording(db, recording_id=recording_id, user_id=current_user.id)
+    db_recording = await crud.get_recording_async(db, recording_id=recording_id, user_id=current_user.id)
     if db_recording is None:
         raise HTTPException(status_code=404, detail="Recording not found")
     return db_recording
@@ -201,6 +410,18 @@ def create_recording(
     print("Creating recording")
     return crud.create_recording(db=db, recording=recording)
 
+@router.post("/bulk")
+def create_recordings_bulk(
+    recordings: List[schemas.RecordingCreate],
+    db: Session = Depends(database.get_db),
+    current_user: User = Depends(auth_service.get_admin_user)
+):
+    """Create many recordings in one request. Admin only."""
+    # Set the user_id to the current user's ID
+    for recording in recordings:
+        recording.user_id = current_user.id
+    return {"count": crud.bulk_create_recordings(db=db, recordings=recordings)}
+
 @router.put("/{recording_id}", response_model=schemas.Recording)
 def update_recording(
     recording_id: int, 
@@ -213,8 +434,11 @@ def update_recording(
     if db_recording is None:
         raise HTTPException(status_code=404, detail="Recording not found")
     
-    # Update the recording
-    return crud.update_recording(db, recording_id=recording_id, recording=recording, user_id=current_user.id)
+    # Update the recording, then drop cached paths; doing it before the commit would
+    # let a concurrent segment request re-cache the old ones
+    updated = crud.update_recording(db, recording_id=recording_id, recording=recording, user_id=current_user.id)
+    forget_hls_location(recording_id)
+    return updated
 
 @router.delete("/{recording_id}")
 def delete_recording(
@@ -234,11 +458,12 @@ def delete_recording(
     # Delete the recording from the database
     db.delete(db_recording)
     db.commit()
+    forget_hls_location(recording_id)
     
     return {"message": "Recording deleted successfully"}
 
 @router.get("/stream/{recording_id}")
-async def stream_recording(
+def stream_recording(
     recording_id: int, 
     request: Request, 
     db: Session = Depends(database.get_db),
@@ -257,24 +482,16 @@ async def stream_recording(
         Dict with stream URL for the recording
     """
     try:
-        # Get recording metadata from database
-        db_recording = crud.get_recording(db, recording_id)
+        # Get recording metadata and check the user's access to it in one query
+        db_recording, has_access = crud.get_recording_with_access(db, recording_id, current_user.id)
         if db_recording is None:
             raise HTTPException(status_code=404, detail="Recording not found")
             
-        # Check if user has access to this recording
-        if db_recording.user_id != current_user.id:
-            # Check if user has access through device association
-            stream_name = db_recording.stream_name
-            user_devices = db.query(Device).filter(
-                Device.users.any(id=current_user.id),
-                Device.is_active == True,
-                Device.stream_key == stream_name
-            ).first()
-                
-            if not user_devices:
-                logger.error(f"User {current_user.id} does not have access to recording {recording_id}")
-                raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+        if not has_access:
+            logger.error(f"User {current_user.id} does not have access to recording {recording_id}")
+            raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+        # The player requests the playlist next, so let that request skip the check
+        remember_access(current_user.id, recording_id)
                 
         # Generate a JWT token for the playlist
         token = auth_service.create_temporary_token(
@@ -307,7 +524,7 @@ async def stream_recording(
         if db_recording.environment == "local" and db_recording.local_hls_path:
             # Verify that the HLS playlist exists
             playlist_path = os.path.join(db_recording.local_hls_path, "playlist.m3u8")
-            if os.path.exists(playlist_path):
+            if local_hls_playlist_exists(recording_id, db_recording.local_hls_path):
                 logger.info(f"Using local HLS path for recording {recording_id}: {db_recording.local_hls_path}")
                 
                 return {
@@ -335,9 +552,10 @@ async def stream_recording(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/hls/{recording_id}/{file_name}")
-async def get_hls_file(
+def get_hls_file(
     recording_id: str, 
     file_name: str,
+    request: Request,
     token: Optional[str] = None,
     db: Session = Depends(database.get_db)
 ):
@@ -346,17 +564,21 @@ async def get_hls_file(
     Uses a signed token for authentication instead of requiring user authentication for each request.
     This allows for better caching and compatibility with video players.
     
-    In AWS mode, serves files directly from S3 using pre-signed URLs.
+    In AWS mode, serves files directly from S3 using pre-signed URLs. The playlist
+    is returned with its segments already pointing at pre-signed S3 URLs; segment
+    requests that still arrive here are redirected.
     In local mode, serves files from the local filesystem.
     
     Args:
         recording_id: ID of the recording
         file_name: Name of the HLS file to serve
+        request: Incoming request, checked for a Range header
         token: Optional signed token for authentication
         db: Database session
     
     Returns:
-        FileResponse containing the requested HLS file or RedirectResponse to S3 URL
+        FileResponse containing the requested HLS file, a 206 StreamingResponse for
+        a byte range of it, or RedirectResponse to S3 URL
     """
     try:
         # For playlist requests, verify the token
@@ -366,20 +588,11 @@ async def get_hls_file(
                 raise HTTPException(status_code=401, detail="Authentication required")
                 
             try:
-                # Log the received token
-                logger.info(f"Received token: {token}")
-                
                 # URL decode the token
                 decoded_token = urllib.parse.unquote(token)
-                logger.info(f"Decoded token: {decoded_token}")
-
-                # Log the temp token secret being used
-                secret_preview = auth_service.temp_token_secret[:10] + "..." if auth_service.temp_token_secret else None
-                logger.info(f"Using temp token secret (preview): {secret_preview}")
-
+                
                 # Verify token and get user_id
-                payload = auth_service.verify_temporary_token(decoded_token)
-                logger.info(f"Token payload: {payload}")
+                payload = verify_playlist_token(decoded_token)
                 
                 user_id = payload.get("user_id")
                 if not user_id:
@@ -392,33 +605,23 @@ async def get_hls_file(
                 logger.error(f"Token verification failed for recording {recording_id}. Error: {str(e)}", exc_info=True)
                 raise HTTPException(status_code=401, detail="Invalid authentication token")
                 
-            # Get recording from database
-            db_recording = crud.get_recording(db, recording_id=int(recording_id))
-            if db_recording is None:
-                logger.error(f"Recording {recording_id} not found")
-                raise HTTPException(status_code=404, detail="Recording not found")
-                
-            # Check if user has access to this recording
-            if db_recording.user_id != user_id:
-                # Check if user has access through device association
-                stream_name = db_recording.stream_name
-                user_devices = db.query(Device).filter(
-                    Device.users.any(id=user_id),
-                    Device.is_active == True,
-                    Device.stream_key == stream_name
-                ).first()
-                
-                if not user_devices and db_recording.recording_metadata and "stream_id" in db_recording.recording_metadata:
-                    stream_id = db_recording.recording_metadata["stream_id"]
-                    user_devices = db.query(Device).filter(
-                        Device.users.any(id=user_id),
-                        Device.is_active == True,
-                        Device.stream_key == stream_id
-                    ).first()
+            if has_cached_access(user_id, int(recording_id)):
+                # Access was just checked; only where the files live is needed
+                db_recording = get_hls_location(db, int(recording_id))
+                if db_recording is None:
+                    logger.error(f"Recording {recording_id} not found")
+                    raise HTTPException(status_code=404, detail="Recording not found")
+            else:
+                # Get recording from database along with the user's access to it
+                db_recording, has_access = crud.get_recording_with_access(db, int(recording_id), user_id)
+                if db_recording is None:
+                    logger.error(f"Recording {recording_id} not found")
+                    raise HTTPException(status_code=404, detail="Recording not found")
                     
-                if not user_devices:
+                if not has_access:
                     logger.error(f"User {user_id} does not have access to recording {recording_id}")
                     raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+                remember_access(user_id, int(recording_id))
                     
             # Check if HLS files are available
             if db_recording.environment == "aws" and not db_recording.s3_hls_path:
@@ -434,8 +637,8 @@ async def get_hls_file(
             # 2. Segments are meaningless without the playlist
             # 3. This allows for better caching
             
-            # Get recording from database (still need it for S3 paths)
-            db_recording = crud.get_recording(db, recording_id=int(recording_id))
+            # Look up where the recording's HLS files live (still need it for S3 paths)
+            db_recording = get_hls_location(db, int(recording_id))
             if db_recording is None:
                 logger.error(f"Recording {recording_id} not found")
                 raise HTTPException(status_code=404, detail="Recording not found")
@@ -451,6 +654,18 @@ async def get_hls_file(
             hls_s3_path = db_recording.s3_hls_path
             logger.info(f"Serving HLS file from S3: {hls_s3_path}/{file_name}")
             
+            if file_name == "playlist.m3u8":
+                # Serve the playlist with pre-signed segment URLs, so segments are
+                # fetched from S3 directly rather than through this endpoint
+                playlist = get_s3_hls_playlist(hls_s3_path)
+                if playlist is not None:
+                    return Response(
+                        content=playlist,
+                        media_type="application/vnd.apple.mpegurl",
+                        headers={"Cache-Control": "no-cache, no-store, must-revalidate"}
+                    )
+                logger.warning(f"Could not rewrite S3 playlist for recording {recording_id}, redirecting instead")
+            
             # Generate a pre-signed URL for the HLS file
             s3_url = get_s3_hls_file_url(hls_s3_path, file_name)
             if not s3_url:
@@ -467,7 +682,7 @@ async def get_hls_file(
             # Add caching headers based on file type
             if file_name.endswith('.ts'):
                 # Cache segments for 1 year (they are immutable)
-                response.headers["Cache-Control"] = "public, max-age=31536000"
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
             else:
                 # Don't cache playlists
                 response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
@@ -482,13 +697,6 @@ async def get_hls_file(
             file_path = os.path.join(db_recording.local_hls_path, file_name)
             logger.info(f"Serving local HLS file: {file_path}")
             
-            if not os.path.exists(file_path):
-                logger.error(f"HLS file not found: {file_path}")
-                raise HTTPException(status_code=404, detail="HLS file not found")
-                
-            # Set content type based on file extension
-            content_type = "application/vnd.apple.mpegurl" if file_name.endswith('.m3u8') else "video/mp2t"
-            
             # Ensure the file path is within the recording's HLS directory (security check)
             abs_hls_dir = os.path.abspath(db_recording.local_hls_path)
             abs_file_path = os.path.abspath(file_path)
@@ -496,16 +704,59 @@ async def get_hls_file(
                 logger.error(f"Invalid file path: {file_path}")
                 raise HTTPException(status_code=400, detail="Invalid file path")
             
-            response = FileResponse(
-                path=file_path,
-                media_type=content_type,
-                filename=file_name
-            )
+            # Stat once here and hand the result to FileResponse, which would
+            # otherwise stat the file again before sending it
+            try:
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
+                stat_result = None
+            if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                logger.error(f"HLS file not found: {file_path}")
+                raise HTTPException(status_code=404, detail="HLS file not found")
+                
+            # Set content type based on file extension
+            content_type = "application/vnd.apple.mpegurl" if file_name.endswith('.m3u8') else "video/mp2t"
+            
+            # Files outside RECORDINGS_DIR are not reachable through the nginx location
+            relative_path = os.path.relpath(abs_file_path, RECORDINGS_DIR)
+            accel_redirect = bool(HLS_ACCEL_REDIRECT_PREFIX) and not relative_path.startswith("..")
+            
+            # Serve just the requested bytes when the player asks for a range
+            byte_range = None if accel_redirect else parse_byte_range(request.headers.get("range"), stat_result.st_size)
+            
+            if accel_redirect:
+                # Let nginx send the file, and handle any byte range, when it fronts the API
+                response = Response(
+                    media_type=content_type,
+                    headers={"X-Accel-Redirect": HLS_ACCEL_REDIRECT_PREFIX + urllib.parse.quote(relative_path)}
+                )
+            elif byte_range is not None:
+                start, end = byte_range
+                response = StreamingResponse(
+                    iter_file_range(file_path, start, end),
+                    status_code=206,
+                    media_type=content_type,
+                    headers={
+                        "Content-Range": f"bytes {start}-{end}/{stat_result.st_size}",
+                        "Content-Length": str(end - start + 1),
+                    }
+                )
+            else:
+                # FileResponse reads the file in 64 KiB chunks on a worker thread, so
+                # segments are streamed without blocking the event loop or being held
+                # in memory whole
+                response = FileResponse(
+                    path=file_path,
+                    media_type=content_type,
+                    filename=file_name,
+                    stat_result=stat_result
+                )
+            response.headers["Accept-Ranges"] = "bytes"
             
             # Add caching headers for better performance
             if file_name.endswith('.ts'):
                 # Cache segments for 1 year (they are immutable)
-                response.headers["Cache-Control"] = "public, max-age=31536000"
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
             else:
                 # Don't cache playlists
                 response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
@@ -519,7 +770,7 @@ async def get_hls_file(
         raise HTTPException(status_code=500, detail="Internal server error while serving HLS file")
 
 @router.get("/{recording_id}/info")
-async def get_recording_info(
+def get_recording_info(
     recording_id: str,
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
@@ -564,6 +815,9 @@ async def get_recording_info(
 def convert_to_streaming_formats(input_path, video_id):
     """
     Convert video to MP4 (if needed) and create adaptive bitrate versions
+    
+    Not called anywhere at present; HLS processing goes through
+    services.video_processor.
     """
     output_dir = f"/tmp/processed/{video_id}"
     os.makedirs(output_dir, exist_ok=True)
@@ -571,49 +825,69 @@ def convert_to_streaming_formats(input_path, video_id):
     # Determine if input is already MP4
     is_mp4 = input_path.lower().endswith('.mp4')
     
-    # Base MP4 conversion (skip if already MP4)
-    base_mp4 = f"{output_dir}/base.mp4"
-    if not is_mp4:
-        subprocess.run([
-            "ffmpeg", "-i", input_path, 
-            "-c:v", "libx264", "-c:a", "aac",
-            "-movflags", "+faststart",  # Optimize for web streaming
-            base_mp4
-        ])
-    else:
-        # If already MP4, just copy the file
-        import shutil
-        shutil.copy(input_path, base_mp4)
+    encoder = get_h264_encoder()
+    
+    # Everything is produced by a single ffmpeg run, so the input is decoded once
+    # and split across the bitrate encodes instead of once per output
+    command = [
+        "ffmpeg", "-y", *get_hwaccel_args(), "-i", input_path,
+        "-filter_complex", "[0:v]split=3[v0][v1][v2]"
+    ]
     
     # Create multiple bitrate versions
     bitrates = ["1500k", "800k", "400k"]
     output_files = []
     
-    for bitrate in bitrates:
+    for i, bitrate in enumerate(bitrates):
         output_file = f"{output_dir}/output_{bitrate}.mp4"
-        subprocess.run([
-            "ffmpeg", "-i", base_mp4,
-            "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", f"{int(bitrate[:-1]) * 2}k",
-            "-c:v", "libx264", "-preset", "medium", "-c:a", "aac",
+        command += [
+            "-map", f"[v{i}]", "-map", "0:a?",
+            *get_h264_bitrate_args(bitrate),
+            "-c:a", "aac",
             output_file
-        ])
+        ]
         output_files.append(output_file)
     
-    # Create HLS playlist
-    subprocess.run([
-        "ffmpeg", "-i", base_mp4,
-        "-codec", "copy",
-        "-start_number", "0",
-        "-hls_time", "10",
-        "-hls_list_size", "0",
-        "-f", "hls",
-        f"{output_dir}/playlist.m3u8"
-    ])
+    # Base MP4 conversion (skip if already MP4) and HLS playlist
+    base_mp4 = f"{output_dir}/base.mp4"
+    playlist_path = f"{output_dir}/playlist.m3u8"
+    if not is_mp4:
+        # Encode the full-resolution stream once and have the tee muxer write it to
+        # both base.mp4 and the HLS playlist, rather than encoding it for each
+        command += [
+            "-map", "0:v", "-map", "0:a?",
+            "-c:v", encoder, "-c:a", "aac",
+            "-flags", "+global_header",  # MP4 needs the codec headers up front; tee cannot request them per output
+            "-f", "tee",
+            f"[movflags=+faststart]{base_mp4}|[f=hls:start_number=0:hls_time=10:hls_list_size=0]{playlist_path}"
+        ]
+    else:
+        # If already MP4, just copy the file and stream-copy it into HLS
+        shutil.copy(input_path, base_mp4)
+        command += [
+            "-map", "0:v", "-map", "0:a?",
+            "-codec", "copy",
+            "-start_number", "0",
+            "-hls_time", "10",
+            "-hls_list_size", "0",
+            "-f", "hls",
+            playlist_path
+        ]
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    
+    if result.returncode != 0:
+        logger.error(f"ffmpeg conversion failed with output:\n{result.stderr}")
+        raise RuntimeError(f"ffmpeg conversion failed: {result.stderr}")
     
     return output_dir 
 
 @router.get("/debug-player/{recording_id}")
-async def get_debug_video_player(recording_id: int, db: Session = Depends(database.get_db)):
+def get_debug_video_player(recording_id: int, request: Request, db: Session = Depends(database.get_db)):
     """Simple debug player for administrators and testing"""
     db_recording = crud.get_recording(db, recording_id=recording_id)
     if db_recording is None:
@@ -631,84 +905,22 @@ async def get_debug_video_player(recording_id: int, db: Session = Depends(databa
     elif db_recording.local_mp4_path:
         file_format = os.path.splitext(db_recording.local_mp4_path)[1].lstrip('.')
     
-    # Create the HLS or direct playback code separately to avoid backslash issues in f-strings
-    if has_hls:
-        player_code = """
-        if (Hls.isSupported()) {
-            var hls = new Hls();
-            hls.loadSource(videoSrc);
-            hls.attachMedia(video);
-            hls.on(Hls.Events.MANIFEST_PARSED, function() {
-                // video.play();
-            });
-        } else if (video.canPlayType('application/vnd.apple.mpegurl')) {
-            video.src = videoSrc;
-            video.addEventListener('loadedmetadata', function() {
-                // video.play();
-            });
-        }
-        """
-    else:
-        player_code = "// Direct MP4 playback\nvideo.src = videoSrc;"
-    
-    # Now build the HTML content without problematic f-string expressions
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Debug Player - Recording {recording_id}</title>
-        <style>
-            body {{ font-family: monospace; margin: 0; padding: 20px; background: #f0f0f0; }}
-            h1 {{ color: #333; }}
-            video {{ max-width: 100%; border: 1px solid #ccc; }}
-            .info {{ margin-top: 20px; background: #fff; padding: 15px; border-radius: 4px; }}
-            .debug {{ margin-top: 20px; background: #333; color: #0f0; padding: 15px; border-radius: 4px; font-family: monospace; }}
-        </style>
-        <script src="https://cdn.jsdelivr.net/npm/hls.js@latest"></script>
-    </head>
-    <body>
-        <h1>Debug Player: {db_recording.stream_name}</h1>
-        <video id="video" controls></video>
-        
-        <div class="info">
-            <p><strong>Recording ID:</strong> {recording_id}</p>
-            <p><strong>Format:</strong> {file_format.upper()}</p>
-            <p><strong>Size:</strong> {db_recording.file_size / (1024 * 1024):.2f} MB</p>
-            <p><strong>Created:</strong> {db_recording.created_at}</p>
-            <p><strong>Environment:</strong> {db_recording.environment}</p>
-        </div>
-        
-        <div class="debug">
-            <p>HLS Available: {has_hls}</p>
-            <p>Stream URL: {'/recordings/hls/' + str(recording_id) + '/playlist.m3u8' if has_hls else '/recordings/stream/' + str(recording_id)}</p>
-            <p>Metadata: {db_recording.recording_metadata}</p>
-        </div>
-        
-        <script>
-            document.addEventListener('DOMContentLoaded', function() {{
-                var video = document.getElementById('video');
-                var videoSrc = '{'/recordings/hls/' + str(recording_id) + '/playlist.m3u8' if has_hls else '/recordings/stream/' + str(recording_id)}';
-                
-                {player_code}
-                
-                // Add debug event listeners
-                video.addEventListener('error', function(e) {{
-                    console.error('Video error:', e);
-                    document.querySelector('.debug').innerHTML += '<p style="color:red">Error: ' + e.target.error.code + '</p>';
-                }});
-            }});
-        </script>
-    </body>
-    </html>
-    """
+    video_src = f"/recordings/hls/{recording_id}/playlist.m3u8" if has_hls else f"/recordings/stream/{recording_id}"
     
-    return Response(
-        content=html_content,
-        media_type="text/html"
-    )
+    response = templates.TemplateResponse("debug_player.html", {
+        "request": request,
+        "recording_id": recording_id,
+        "recording": db_recording,
+        "has_hls": has_hls,
+        "file_format": file_format,
+        "video_src": video_src
+    })
+    # The page only changes when processing completes
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
 
 @router.get("/{recording_id}/playback-info")
-async def get_recording_playback_info(
+def get_recording_playback_info(
     recording_id: int,
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
@@ -757,65 +969,32 @@ async def get_recording_playback_info(
     return response 
 
 @router.get("/streams")
-async def get_streams(
+def get_streams(
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
     """Get a list of unique stream IDs for the current user"""
-    recordings = crud.get_recordings(db, user_id=current_user.id)
-    
-    # Extract unique stream IDs from recording metadata
-    streams = {}
-    for recording in recordings:
-        stream_id = None
-        if recording.recording_metadata and "stream_id" in recording.recording_metadata:
-            stream_id = recording.recording_metadata["stream_id"]
-        else:
-            # Fallback to stream name if no stream_id
-            stream_id = recording.stream_name
-        
-        if stream_id not in streams:
-            streams[stream_id] = {
-                "stream_id": stream_id,
-                "stream_name": recording.stream_name,
-                "recording_count": 1,
-                "first_recording": recording.created_at,
-                "latest_recording": recording.created_at,
-                "total_size": recording.file_size
-            }
-        else:
-            streams[stream_id]["recording_count"] += 1
-            streams[stream_id]["total_size"] += recording.file_size
-            
-            # Update timestamps
-            if recording.created_at < streams[stream_id]["first_recording"]:
-                streams[stream_id]["first_recording"] = recording.created_at
-            if recording.created_at > streams[stream_id]["latest_recording"]:
-                streams[stream_id]["latest_recording"] = recording.created_at
-    
-    return {"streams": list(streams.values())}
+    return ORJSONResponse({"streams": crud.get_streams(db, user_id=current_user.id)})
 
 @router.get("/streams/{stream_id}/recordings")
-async def get_stream_recordings(
+def get_stream_recordings(
     stream_id: str,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
 ):
     """Get all recordings for a specific stream ID for the current user"""
-    recordings = crud.get_recordings(db, user_id=current_user.id)
-    
-    # Filter recordings by stream ID
-    stream_recordings = []
-    for recording in recordings:
-        if (recording.recording_metadata and 
-            "stream_id" in recording.recording_metadata and 
-            recording.recording_metadata["stream_id"] == stream_id):
-            stream_recordings.append(recording)
-        elif stream_id == recording.stream_name:
-            # Fallback to stream name if no stream_id
-            stream_recordings.append(recording)
+    recordings = crud.get_stream_recordings(
+        db, user_id=current_user.id, stream_id=stream_id, skip=skip, limit=limit,
+        after=parse_cursor(cursor)
+    )
     
-    return {"recordings": [schemas.Recording.from_orm(r) for r in stream_recordings]}
+    return ORJSONResponse({
+        "recordings": to_recording_dicts(recordings),
+        "next_cursor": next_cursor(recordings, limit)
+    })
 
 @router.post("/rtmp/{stream_key}", response_model=schemas.Recording)
 def create_recording_from_rtmp(
@@ -831,10 +1010,17 @@ def create_recording_from_rtmp(
         logger.info(f"Received RTMP recording request for stream key: {stream_key}")
         logger.info(f"Recording data: {recording}")
         
-        # Find device by stream key
-        device = db.query(Device).filter(
-            Device.stream_key == stream_key,
-            Device.is_active == True
+        # Find the active device for the stream key and the first user linked to it
+        # in one query, using the stream key index, without loading either object
+        device = db.execute(
+            select(Device.id, user_device_association.c.user_id).outerjoin(
+                user_device_association, user_device_association.c.device_id == Device.id
+            ).where(
+                Device.stream_key == stream_key,
+                Device.is_active.is_(True)
+            ).order_by(
+                user_device_association.c.created_at
+            ).limit(1)
         ).first()
         
         if not device:
@@ -842,11 +1028,11 @@ def create_recording_from_rtmp(
             raise HTTPException(status_code=404, detail="Invalid stream key")
         
         # Get the first user associated with this device
-        if not device.users:
+        if device.user_id is None:
             logger.error(f"Device {device.id} has no associated users")
             raise HTTPException(status_code=400, detail="Device has no associated users")
             
-        user_id = device.users[0].id
+        user_id = device.user_id
         logger.info(f"Found device: {device.id} for user: {user_id}")
         
         # Add user_id to the recording dictionary
@@ -876,7 +1062,7 @@ def create_recording_from_rtmp(
         raise HTTPException(status_code=500, detail=str(e)) 
 
 @router.get("/{recording_id}/status")
-async def get_recording_status(
+def get_recording_status(
     recording_id: int,
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
@@ -891,33 +1077,13 @@ async def get_recording_status(
         Status information about the recording
     """
     try:
-        # Get recording from database
-        db_recording = crud.get_recording(db, recording_id=recording_id)
+        # Get recording from database and check permissions in one query
+        db_recording, has_access = crud.get_recording_with_access(db, recording_id, current_user.id)
         if db_recording is None:
             raise HTTPException(status_code=404, detail="Recording not found")
             
-        # Check permissions
-        if db_recording.user_id != current_user.id:
-            # Check if user has access through device association
-            stream_name = db_recording.stream_name
-            user_devices = db.query(Device).filter(
-                Device.users.any(id=current_user.id),
-                Device.is_active == True,
-                Device.stream_key == stream_name
-            ).first()
-            
-            if not user_devices:
-                # Try with stream_id from metadata
-                if db_recording.recording_metadata and "stream_id" in db_recording.recording_metadata:
-                    stream_id = db_recording.recording_metadata["stream_id"]
-                    user_devices = db.query(Device).filter(
-                        Device.users.any(id=current_user.id),
-                        Device.is_active == True,
-                        Device.stream_key == stream_id
-                    ).first()
-                    
-                if not user_devices:
-                    raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+        if not has_access:
+            raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
         
         # Check if metadata exists
         if not db_recording.recording_metadata:
@@ -984,8 +1150,64 @@ async def get_recording_status(
         logger.error(f"Error getting recording status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e)) 
 
+@router.post("/{recording_id}/process", status_code=202)
+def queue_recording_processing(
+    recording_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: User = Depends(auth_service.get_admin_user)
+) -> Dict[str, Any]:
+    """
+    Queue HLS processing of a recording in the background. Admin only.
+    
+    Returns as soon as the job is submitted; poll /{recording_id}/processing-status
+    for progress. Submitting again while a job is running returns the same task;
+    submitting after a failed run discards that run's output and starts over.
+    
+    Args:
+        recording_id: ID of the recording to process
+        
+    Returns:
+        Task ID and current status of the processing job
+    """
+    db_recording, has_access = crud.get_recording_with_access(db, recording_id, current_user.id)
+    if db_recording is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+        
+    if not has_access:
+        raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+    
+    task = check_task_exists(recording_id)
+    last_status = (db_recording.recording_metadata or {}).get("transcoding_status")
+    if last_status == "failed" and (task is None or task["status"] == "failed"):
+        # Several workers may see the same failure; only the one that flips the status
+        # back to processing clears the old output and submits the job
+        if not claim_failed_processing(db, recording_id):
+            logger.info(f"Reprocessing of recording {recording_id} was already claimed")
+            return {
+                "recording_id": recording_id,
+                "task_id": f"task-{recording_id}",
+                "status": "processing"
+            }
+        
+        # A failed run may have left output behind, e.g. a truncated playlist written
+        # before playlists were packaged under a temporary name. Clear it so the new job
+        # transcodes from scratch instead of taking that output as finished.
+        hls_output_dir = os.path.join(HLS_DIR, str(recording_id))
+        if os.path.isdir(hls_output_dir):
+            logger.info(f"Removing output of failed processing run for recording {recording_id}: {hls_output_dir}")
+            shutil.rmtree(hls_output_dir)
+            forget_hls_location(recording_id)
+    
+    task_id = submit_processing_job(recording_id)
+    task = check_task_exists(recording_id) or {}
+    return {
+        "recording_id": recording_id,
+        "task_id": task_id,
+        "status": task.get("status", "processing")
+    }
+
 @router.get("/{recording_id}/processing-status")
-async def get_recording_processing_status(
+def get_recording_processing_status(
     recording_id: int,
     db: Session = Depends(database.get_db),
     current_user: User = Depends(auth_service.get_current_user)
@@ -1001,31 +1223,13 @@ async def get_recording_processing_status(
         Current status information
     """
     try:
-        # Get recording from database
-        db_recording = crud.get_recording(db, recording_id=recording_id)
+        # Get recording from database and check the user's access in one query
+        db_recording, has_access = crud.get_recording_with_access(db, recording_id, current_user.id)
         if db_recording is None:
             raise HTTPException(status_code=404, detail="Recording not found")
             
-        # Check if the recording belongs to the current user
-        if db_recording.user_id != current_user.id:
-            # Check if user has access through device association
-            stream_name = db_recording.stream_name
-            user_devices = db.query(Device).filter(
-                Device.users.any(id=current_user.id),
-                Device.is_active == True,
-                Device.stream_key == stream_name
-            ).first()
-            
-            if not user_devices and db_recording.recording_metadata and "stream_id" in db_recording.recording_metadata:
-                stream_id = db_recording.recording_metadata["stream_id"]
-                user_devices = db.query(Device).filter(
-                    Device.users.any(id=current_user.id),
-                    Device.is_active == True,
-                    Device.stream_key == stream_id
-                ).first()
-                
-            if not user_devices:
-                raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
+        if not has_access:
+            raise HTTPException(status_code=403, detail="You do not have permission to access this recording")
         
         # Check if there's a ready HLS version
         hls_path = None
@@ -1033,7 +1237,7 @@ async def get_recording_processing_status(
         
         if db_recording.environment == "local" and db_recording.local_hls_path:
             hls_path = db_recording.local_hls_path
-            hls_exists = os.path.exists(os.path.join(hls_path, "playlist.m3u8"))
+            hls_exists = local_hls_playlist_exists(recording_id, hls_path)
         elif db_recording.environment == "aws" and db_recording.s3_hls_path:
             hls_path = db_recording.s3_hls_path
             hls_exists = True  # Assume S3 files exist if path is set
@@ -1054,7 +1258,7 @@ async def get_recording_processing_status(
                 
         # Check for processing task
         try:
-            existing_task = await check_task_exists(recording_id)
+            existing_task = check_task_exists(recording_id)
             
             if existing_task:
                 # Translate processing task status to our status format
@@ -17,7 +17,7 @@ router = APIRouter(
 )
 
 @router.get("/validate/{stream_key}")
-async def validate_stream_key(stream_key: str, db: Session = Depends(get_db)):
+def validate_stream_key(stream_key: str, db: Session = Depends(get_db)):
     """
     Validate if a stream key exists and is associated with an active device.
     Returns:
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 import logging
+import time
 from .. import database, models
 from ..services.auth import auth_service
 from ..utils.stream_keys import generate_stream_key, validate_stream_key
@@ -38,6 +39,10 @@ class Auth0UserInfo(BaseModel):
     email: str
     auth0_id: str
 
+def _query_user_with_devices(db: Session):
+    """User query that eager-loads devices, which UserResponse serializes."""
+    return db.query(models.User).options(selectinload(models.User.devices))
+
 router = APIRouter(
     prefix="/users",
     tags=["users"],
@@ -45,7 +50,7 @@ router = APIRouter(
 )
 
 @router.post("/stream-keys", response_model=List[str])
-async def create_stream_key(
+def create_stream_key(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth_service.get_admin_user)
 ):
@@ -66,14 +71,14 @@ async def create_stream_key(
     return stream_keys
 
 @router.get("/stream-keys", response_model=List[str])
-async def get_stream_keys(
+def get_stream_keys(
     current_user: models.User = Depends(auth_service.get_current_user)
 ):
     """Get all stream keys for the current user."""
     return current_user.stream_keys or []
 
 @router.delete("/stream-keys/{stream_key}", response_model=List[str])
-async def delete_stream_key(
+def delete_stream_key(
     stream_key: str,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth_service.get_admin_user)
@@ -94,7 +99,7 @@ async def delete_stream_key(
     return stream_keys
 
 @router.post("/post-login", response_model=UserResponse)
-async def post_login(
+def post_login(
     user_info: Auth0UserInfo,
     db: Session = Depends(database.get_db)
 ):
@@ -106,21 +111,20 @@ async def post_login(
     logger.info(f"Post-login called with auth0_id: {user_info.auth0_id}, email: {user_info.email}")
     
     # Check if user exists by auth0_id
-    user = db.query(models.User).filter(models.User.auth0_id == user_info.auth0_id).first()
+    user = _query_user_with_devices(db).filter(models.User.auth0_id == user_info.auth0_id).first()
     
     if user:
         logger.info(f"Found existing user with id: {user.id}")
         return user
     
     # If not found by auth0_id, check by email as fallback
-    user = db.query(models.User).filter(models.User.email == user_info.email).first()
+    user = _query_user_with_devices(db).filter(models.User.email == user_info.email).first()
     if user:
         # User found by email but not auth0_id - this should be rare
         # This might happen if auth0_id was changed or migrated
         logger.info(f"Found user by email with id: {user.id}, updating auth0_id")
         user.auth0_id = user_info.auth0_id
         db.commit()
-        db.refresh(user)
         return user
         
     # User not found - implement retry logic for creation
@@ -130,7 +134,7 @@ async def post_login(
     while retry_count < max_retries:
         try:
             # Check one more time in case user was created in another request
-            user = db.query(models.User).filter(models.User.auth0_id == user_info.auth0_id).first()
+            user = _query_user_with_devices(db).filter(models.User.auth0_id == user_info.auth0_id).first()
             if user:
                 logger.info(f"User was created by another process, found with id: {user.id}")
                 return user
@@ -164,7 +168,7 @@ async def post_login(
             
             db.commit()
             logger.info("Committed transaction successfully")
-            db.refresh(user)
+            user = _query_user_with_devices(db).populate_existing().filter(models.User.id == user.id).first()
             logger.info(f"Refreshed user object, has {len(user.devices)} devices")
             
             return user
@@ -182,11 +186,10 @@ async def post_login(
                 )
                 
             # Small delay to prevent immediate retry
-            import asyncio
-            await asyncio.sleep(0.2)
+            time.sleep(0.2)
             
             # After waiting, check if another process created the user
-            user = db.query(models.User).filter(models.User.auth0_id == user_info.auth0_id).first()
+            user = _query_user_with_devices(db).filter(models.User.auth0_id == user_info.auth0_id).first()
             if user:
                 logger.info(f"User was created by another process during retry, found with id: {user.id}")
                 return user 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Union
 from datetime import datetime
 
 class RecordingBase(BaseModel):
@@ -25,9 +25,22 @@ class Recording(RecordingBase):
     class Config:
         orm_mode = True
 
+class RecordingSummary(BaseModel):
+    """The columns a recording list view renders, without paths or metadata."""
+    id: int
+    stream_name: str
+    created_at: datetime
+    file_size: Optional[int] = None
+    duration: Optional[int] = None
+    environment: str
+
+    class Config:
+        orm_mode = True
+
 class RecordingList(BaseModel):
-    recordings: List[Recording]
+    recordings: List[Union[Recording, RecordingSummary]]
     count: int
+    next_cursor: Optional[str] = None
 
 class DeviceBase(BaseModel):
     name: str
@@ -254,13 +254,9 @@ class AuthService:
             )
             
         try:
-            logger.info(f"Verifying token: {token}")
-            logger.info(f"Using secret (preview): {self.temp_token_secret[:10]}...")
-            
             # First try to decode without verification to check structure
             try:
                 unverified_header = jwt.get_unverified_header(token)
-                logger.info(f"Token header: {unverified_header}")
                 if unverified_header.get("alg") != "HS256":
                     raise ValueError(f"Invalid algorithm: {unverified_header.get('alg')}")
             except Exception as e:
@@ -278,8 +274,6 @@ class AuthService:
                 algorithms=["HS256"]
             )
             
-            logger.info(f"Token payload: {payload}")
-            
             # Verify required claims
             if "user_id" not in payload:
                 raise ValueError("Missing user_id claim")
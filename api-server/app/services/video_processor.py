@@ -1,13 +1,16 @@
 import os
 import logging
 import tempfile
+import time
 from datetime import datetime
 import threading
+from sqlalchemy import Text, cast, func, update
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app.models import Recording
 from app.utils.video import process_video_for_streaming
-from app.utils.s3 import download_from_s3
+from app.utils.s3 import download_from_s3, generate_presigned_url
 from typing import Dict, Any, Optional
 
 # Configure logging
@@ -16,6 +19,23 @@ logger = logging.getLogger(__name__)
 # Store active processing tasks
 active_tasks = {}
 
+# Transcoding is CPU-bound, so cap how many jobs run at once per process;
+# further jobs wait in their thread until a slot frees up
+TRANSCODE_WORKERS = max(1, int(os.getenv("TRANSCODE_WORKERS", "2")))
+_transcode_slots = threading.BoundedSemaphore(TRANSCODE_WORKERS)
+
+# Failed jobs (e.g. a transient S3 or database error) are retried with exponential
+# backoff before the failure is left for the status endpoints to report
+PROCESSING_MAX_ATTEMPTS = max(1, int(os.getenv("PROCESSING_MAX_ATTEMPTS", "3")))
+PROCESSING_RETRY_BASE_DELAY = float(os.getenv("PROCESSING_RETRY_BASE_DELAY", "5"))
+
+# Lifetime of the pre-signed URL ffmpeg reads S3 recordings through; it has to
+# outlast the whole transcode since ffmpeg may reconnect part way through
+S3_INPUT_URL_EXPIRATION = int(os.getenv("S3_INPUT_URL_EXPIRATION", str(6 * 3600)))
+
+RECORDINGS_DIR = "/recordings"
+HLS_DIR = os.path.join(RECORDINGS_DIR, "hls")
+
 def get_db_session():
     """Get a new database session"""
     return SessionLocal()
@@ -23,27 +43,94 @@ def get_db_session():
 def update_transcoding_status(db: Session, recording_id: int, status: str, error_message: str = None):
     """Helper function to update transcoding status"""
     try:
-        recording = db.query(Recording).filter(Recording.id == recording_id).first()
-        if not recording:
+        fields = {
+            "transcoding_status": cast(status, Text),
+            "transcoding_completed_at": func.now()
+        }
+        if error_message:
+            fields["transcoding_error"] = cast(error_message, Text)
+        
+        # Merge the status into the metadata with a single UPDATE, timestamped by the
+        # database, instead of loading the row and writing the whole document back
+        patch = func.jsonb_build_object(*[item for key, value in fields.items() for item in (cast(key, Text), value)])
+        result = db.execute(
+            update(Recording)
+            .where(Recording.id == recording_id)
+            .values(recording_metadata=func.coalesce(Recording.recording_metadata, func.jsonb_build_object()).op("||", return_type=JSONB)(patch))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
             logger.error(f"Recording {recording_id} not found")
+            db.rollback()
             return
-            
-        metadata = recording.recording_metadata or {}
-        metadata.update({
-            "transcoding_status": status,
-            "transcoding_completed_at": datetime.now().isoformat()
-        })
         
-        if error_message:
-            metadata["transcoding_error"] = error_message
-            
-        recording.recording_metadata = metadata
         db.commit()
         logger.info(f"Updated transcoding status to {status} for recording {recording_id}")
     except Exception as e:
         logger.error(f"Failed to update transcoding status: {str(e)}")
         db.rollback()
 
+def claim_failed_processing(db: Session, recording_id: int) -> bool:
+    """
+    Atomically move a recording whose last processing run failed back to processing.
+    
+    Only one caller across all worker processes can succeed for a given failure, so
+    only that caller may clear the failed run's output and submit a new job.
+    
+    Returns:
+        True if the status was flipped, False if the recording is not (or no longer) failed
+    """
+    patch = func.jsonb_build_object(cast("transcoding_status", Text), cast("processing", Text))
+    try:
+        result = db.execute(
+            update(Recording)
+            .where(
+                Recording.id == recording_id,
+                Recording.recording_metadata["transcoding_status"].astext == "failed"
+            )
+            .values(recording_metadata=Recording.recording_metadata.op("||", return_type=JSONB)(patch))
+            .returning(Recording.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = result.first() is not None
+        db.commit()
+        return claimed
+    except Exception as e:
+        logger.error(f"Failed to claim recording {recording_id} for reprocessing: {str(e)}")
+        db.rollback()
+        return False
+
+def run_processing_job(recording_id: int):
+    """Run process_recording once a transcoding slot is available, retrying failed attempts."""
+    for attempt in range(1, PROCESSING_MAX_ATTEMPTS + 1):
+        with _transcode_slots:
+            process_recording(recording_id)
+            
+        task = active_tasks.get(recording_id, {})
+        if task.get("status") != "failed" or attempt == PROCESSING_MAX_ATTEMPTS:
+            return
+            
+        # Wait outside the transcoding slot so other jobs can use it meanwhile
+        delay = PROCESSING_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+        logger.warning(
+            f"Processing attempt {attempt} for recording {recording_id} failed: {task.get('error')}. "
+            f"Retrying in {delay:.0f}s"
+        )
+        active_tasks[recording_id] = {
+            "status": "processing",
+            "attempt": attempt + 1,
+            "last_error": task.get("error"),
+            "started_at": datetime.now().isoformat()
+        }
+        # The failed attempt left the row marked failed; mark it processing again so
+        # other workers do not take the recording for a finished failure and resubmit it
+        db = get_db_session()
+        try:
+            update_transcoding_status(db, recording_id, "processing")
+        finally:
+            db.close()
+        time.sleep(delay)
+
 def process_recording(recording_id: int):
     """
     Process a video recording for HLS streaming.
@@ -75,7 +162,7 @@ def process_recording(recording_id: int):
             logger.info(f"Recording {recording_id} already has HLS files in S3, skipping processing")
             
             # Update metadata to show it's already processed
-            metadata = db_recording.recording_metadata or {}
+            metadata = dict(db_recording.recording_metadata or {})
             metadata.update({
                 "processed": True,
                 "transcoding_status": "completed",
@@ -96,9 +183,19 @@ def process_recording(recording_id: int):
             active_tasks[recording_id] = {"status": "completed", "s3_hls_processed": True}
             return
         
+        # Record on the row that transcoding has started, so status endpoints in
+        # every worker process can report it, not just this one
+        metadata = dict(db_recording.recording_metadata or {})
+        metadata.update({
+            "transcoding_status": "processing",
+            "transcoding_started_at": datetime.now().isoformat()
+        })
+        metadata.pop("transcoding_error", None)
+        db_recording.recording_metadata = metadata
+        db.commit()
+        
         # If not already processed by rtmp-server, continue with normal processing
         # Ensure HLS directory exists
-        HLS_DIR = "/recordings/hls"
         os.makedirs(HLS_DIR, exist_ok=True)
         hls_output_dir = os.path.join(HLS_DIR, str(recording_id))
         
@@ -106,8 +203,8 @@ def process_recording(recording_id: int):
         if db_recording.environment == "local":
             # Handle local file
             file_path = db_recording.local_mp4_path
-            if not file_path.startswith('/recordings/'):
-                file_path = os.path.join("/recordings", os.path.basename(file_path))
+            if not file_path.startswith(RECORDINGS_DIR + '/'):
+                file_path = os.path.join(RECORDINGS_DIR, os.path.basename(file_path))
             
             if not os.path.exists(file_path):
                 error_msg = f"File not found at {file_path}"
@@ -141,28 +238,33 @@ def process_recording(recording_id: int):
             if s3_path.startswith("s3://"):
                 s3_path = s3_path[5:]
                 
-            # Download from S3
             with tempfile.NamedTemporaryFile(suffix='.mp4') as temp_file:
-                logger.info(f"Downloading from S3: {s3_path}")
-                
-                try:
-                    if not download_from_s3(s3_path, temp_file.name):
-                        error_msg = "Failed to download file from S3"
+                # Have ffmpeg read the object through a pre-signed URL so encoding
+                # starts as the bytes arrive, instead of writing it all to disk and
+                # reading it back. Downloading is the fallback.
+                input_path = generate_presigned_url(s3_path, expiration=S3_INPUT_URL_EXPIRATION)
+                if input_path is None:
+                    logger.info(f"Downloading from S3: {s3_path}")
+                    input_path = temp_file.name
+                    
+                    try:
+                        if not download_from_s3(s3_path, temp_file.name):
+                            error_msg = "Failed to download file from S3"
+                            logger.error(error_msg)
+                            update_transcoding_status(db, recording_id, "failed", error_msg)
+                            active_tasks[recording_id] = {"status": "failed", "error": error_msg}
+                            return
+                    except Exception as e:
+                        error_msg = f"S3 download error: {str(e)}"
                         logger.error(error_msg)
                         update_transcoding_status(db, recording_id, "failed", error_msg)
                         active_tasks[recording_id] = {"status": "failed", "error": error_msg}
                         return
-                except Exception as e:
-                    error_msg = f"S3 download error: {str(e)}"
-                    logger.error(error_msg)
-                    update_transcoding_status(db, recording_id, "failed", error_msg)
-                    active_tasks[recording_id] = {"status": "failed", "error": error_msg}
-                    return
                     
                 # Process video for HLS streaming
-                logger.info(f"Processing S3 video for streaming: {temp_file.name}")
+                logger.info(f"Processing S3 video for streaming: {s3_path}")
                 try:
-                    playlist_path, video_info = process_video_for_streaming(temp_file.name, hls_output_dir)
+                    playlist_path, video_info = process_video_for_streaming(input_path, hls_output_dir)
                     logger.info(f"HLS playlist created at: {playlist_path}")
                 except Exception as e:
                     error_msg = f"Failed to process S3 video: {str(e)}"
@@ -172,7 +274,7 @@ def process_recording(recording_id: int):
                     return
         
         # Update recording metadata with HLS information
-        metadata = db_recording.recording_metadata or {}
+        metadata = dict(db_recording.recording_metadata or {})
         metadata.update({
             "hls_path": hls_output_dir,
             "processed": True,
@@ -223,13 +325,13 @@ def process_recording(recording_id: int):
             # Try to update status to failed
             update_transcoding_status(db, recording_id, "failed", error_msg)
             active_tasks[recording_id] = {"status": "failed", "error": error_msg}
-        except:
+        except Exception:
             logger.error("Could not update failure status in database")
         return
     finally:
         db.close()
 
-async def submit_processing_job(recording_id: int) -> str:
+def submit_processing_job(recording_id: int) -> str:
     """
     Submit a video processing job to run in a background thread.
     
@@ -240,20 +342,22 @@ async def submit_processing_job(recording_id: int) -> str:
         Task ID of the submitted job
     """
     try:
-        # Check if there's already a task running for this recording
-        if recording_id in active_tasks:
-            logger.info(f"Task already exists for recording {recording_id}: {active_tasks[recording_id]}")
+        # Check if there's already a task for this recording; failed ones may be retried
+        existing_task = active_tasks.get(recording_id)
+        if existing_task is not None and existing_task.get("status") != "failed":
+            logger.info(f"Task already exists for recording {recording_id}: {existing_task}")
             return f"task-{recording_id}"
             
+        # Register the task before starting its thread, so a job that finishes
+        # quickly cannot have its final status overwritten with "processing"
+        task_id = f"task-{recording_id}"
+        active_tasks[recording_id] = {"status": "processing", "started_at": datetime.now().isoformat()}
+        
         # Start a new background thread for processing
-        thread = threading.Thread(target=process_recording, args=(recording_id,))
+        thread = threading.Thread(target=run_processing_job, args=(recording_id,))
         thread.daemon = True
         thread.start()
         
-        # Create task ID and add to active tasks
-        task_id = f"task-{recording_id}"
-        active_tasks[recording_id] = {"status": "processing", "started_at": datetime.now().isoformat()}
-        
         logger.info(f"Submitted processing job for recording {recording_id}, task ID: {task_id}")
         return task_id
     except Exception as e:
@@ -272,7 +376,7 @@ async def submit_processing_job(recording_id: int) -> str:
         active_tasks[recording_id] = {"status": "failed", "error": str(e)}
         return task_id
 
-async def check_task_exists(recording_id: int) -> Optional[Dict[str, Any]]:
+def check_task_exists(recording_id: int) -> Optional[Dict[str, Any]]:
     """
     Check if a processing task already exists for a recording.
     
@@ -4,34 +4,74 @@ import logging
 from dotenv import load_dotenv
 from typing import Tuple, Optional, BinaryIO, Dict
 import requests
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 import json
 from urllib.parse import urlparse
 import io
 import tempfile
+import threading
+import time
+from functools import lru_cache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Resolve configuration once at import instead of on every S3 call
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME', 'bucket-d8mdwm')
+AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
+
+# For Lightsail buckets, we need to use the regional endpoint
+S3_ENDPOINT_URL = f'https://s3.{AWS_REGION}.amazonaws.com'
+
+# Large recordings are transferred as concurrent ranged parts instead of one
+# sequential stream. Concurrency should stay within max_pool_connections below.
+MB = 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', '10'))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', str(8 * MB)))
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_CHUNKSIZE,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+
+# The process-wide S3 client, built on first use
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
 def get_s3_client():
     """
     Get an S3 client configured for Lightsail bucket access.
     
+    The client is built once per process and shared; boto3 clients are
+    thread-safe, and constructing one parses the botocore service model.
+    The first call is made under a lock, so worker threads racing to use S3
+    at startup do not each build their own client.
+    
     Returns:
         boto3.client: Configured S3 client
     """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = _create_s3_client()
+    return _s3_client
+
+def _create_s3_client():
+    """Build the S3 client returned by get_s3_client."""
     # Log AWS credentials status (without revealing the actual values)
-    access_key_status = "set" if os.getenv("AWS_ACCESS_KEY_ID") else "not set"
-    secret_key_status = "set" if os.getenv("AWS_SECRET_ACCESS_KEY") else "not set"
+    access_key_status = "set" if AWS_ACCESS_KEY_ID else "not set"
+    secret_key_status = "set" if AWS_SECRET_ACCESS_KEY else "not set"
     logger.info(f"AWS credentials status - Access Key: {access_key_status}, Secret Key: {secret_key_status}")
     
-    region = os.getenv('AWS_REGION', 'us-east-1')
-    bucket_name = os.getenv('AWS_BUCKET_NAME', 'bucket-d8mdwm')
-    
     # Create a config specifically for Lightsail bucket access
     config = Config(
-        region_name=region,
+        region_name=AWS_REGION,
         retries={
             'max_attempts': 5,
             'mode': 'adaptive',
@@ -43,24 +83,23 @@ def get_s3_client():
             'use_accelerate_endpoint': False
         },
         connect_timeout=10,
-        read_timeout=30
+        read_timeout=30,
+        # The shared client serves every worker thread, so allow more than
+        # botocore's default of 10 pooled connections
+        max_pool_connections=50
     )
     
-    # For Lightsail buckets, we need to use the regional endpoint
-    endpoint_url = f'https://s3.{region}.amazonaws.com'
-    
-    if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY"):
-        access_key = os.getenv('AWS_ACCESS_KEY_ID')
-        secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+    if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
+        logger.info(f"Using S3 endpoint: {S3_ENDPOINT_URL} with path-style addressing")
         
-        logger.info(f"Using S3 endpoint: {endpoint_url} with path-style addressing")
-        
-        return boto3.client(
+        # A dedicated session: boto3's shared default session is not safe to
+        # create clients from concurrently
+        return boto3.session.Session().client(
             's3',
-            region_name=region,
-            endpoint_url=endpoint_url,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
+            region_name=AWS_REGION,
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
             config=config
         )
     else:
@@ -81,8 +120,6 @@ def generate_presigned_url(s3_path: str, expiration: int = 3600) -> Optional[str
     try:
         bucket_name, object_key = parse_s3_path(s3_path)
         s3_client = get_s3_client()
-        region = os.getenv('AWS_REGION', 'us-east-1')
-        use_lightsail_bucket = os.getenv('USE_LIGHTSAIL_BUCKET', 'true').lower() == 'true'
 
         # Common parameters for pre-signed URL
         params = {
@@ -139,27 +176,18 @@ def download_from_s3(s3_path: str, local_path: str) -> bool:
         s3_client = get_s3_client()
         
         try:
-            # Create a temporary file to store the download
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                logger.info(f"Downloading from Lightsail bucket: {bucket_name}/{object_key}")
-                
-                # Use get_object instead of download_fileobj for better error handling
-                response = s3_client.get_object(
-                    Bucket=bucket_name,
-                    Key=object_key
-                )
-                
-                # Stream the content to avoid memory issues with large files
-                for chunk in response['Body'].iter_chunks(chunk_size=8192):
-                    temp_file.write(chunk)
-                
-                temp_file_path = temp_file.name
-            
             # Ensure the target directory exists
             os.makedirs(os.path.dirname(local_path), exist_ok=True)
             
-            # Move the temporary file to the target location
-            os.replace(temp_file_path, local_path)
+            # download_file writes to a temporary name and renames it into place
+            # once every part has arrived, so local_path is never left half-written
+            logger.info(f"Downloading from Lightsail bucket: {bucket_name}/{object_key}")
+            s3_client.download_file(
+                Bucket=bucket_name,
+                Key=object_key,
+                Filename=local_path,
+                Config=TRANSFER_CONFIG
+            )
             logger.info(f"Successfully downloaded {s3_path} to {local_path}")
             return True
             
@@ -178,14 +206,18 @@ def download_from_s3(s3_path: str, local_path: str) -> bool:
         if os.path.exists(local_path):
             try:
                 os.remove(local_path)
-            except:
+            except OSError:
                 pass
         return False
 
+@lru_cache(maxsize=4096)
 def parse_s3_path(s3_path: str) -> Tuple[str, str]:
     """
     Parse an S3 path into bucket name and object key.
     
+    Results are memoized, since the same playlist and segment paths are
+    resolved over and over while a recording is being played.
+    
     Args:
         s3_path: Path in format bucket-name/object-key or s3://bucket-name/object-key
         
@@ -220,7 +252,8 @@ def upload_to_s3(local_path: str, s3_path: str) -> bool:
         s3_client.upload_file(
             Filename=local_path,
             Bucket=bucket_name,
-            Key=object_key
+            Key=object_key,
+            Config=TRANSFER_CONFIG
         )
         
         return True
@@ -228,6 +261,12 @@ def upload_to_s3(local_path: str, s3_path: str) -> bool:
         logger.error(f"Error uploading to S3 bucket: {str(e)}")
         return False
 
+# Short-lived cache of pre-signed HLS URLs. Players request the same playlist and
+# segments repeatedly, and a cached URL stays valid for most of its expiration.
+HLS_URL_CACHE_TTL = 300
+HLS_URL_CACHE_MAX_ENTRIES = 10000
+_hls_url_cache: Dict[Tuple[str, str, int], Tuple[float, str]] = {}
+
 def get_s3_hls_file_url(s3_path: str, file_name: str, expiration: int = 3600) -> Optional[str]:
     """
     Generate a pre-signed URL for an HLS-related file (playlist.m3u8 or .ts segments).
@@ -241,6 +280,11 @@ def get_s3_hls_file_url(s3_path: str, file_name: str, expiration: int = 3600) ->
     Returns:
         Pre-signed URL or None if error
     """
+    cache_key = (s3_path, file_name, expiration)
+    cached = _hls_url_cache.get(cache_key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    
     try:
         # Determine content type based on file extension
         content_type = "application/vnd.apple.mpegurl" if file_name.endswith('.m3u8') else "video/mp2t"
@@ -270,6 +314,11 @@ def get_s3_hls_file_url(s3_path: str, file_name: str, expiration: int = 3600) ->
             )
             
             logger.info(f"Generated pre-signed URL for HLS file: {file_name}")
+            
+            # Never serve a cached URL past the point where it would expire
+            if len(_hls_url_cache) >= HLS_URL_CACHE_MAX_ENTRIES:
+                _hls_url_cache.clear()
+            _hls_url_cache[cache_key] = (time.monotonic() + min(HLS_URL_CACHE_TTL, expiration // 2), url)
             return url
             
         except ClientError as e:
@@ -280,4 +329,48 @@ def get_s3_hls_file_url(s3_path: str, file_name: str, expiration: int = 3600) ->
             
     except Exception as e:
         logger.error(f"Error generating pre-signed URL for HLS file: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+# Segment URLs written into a playlist have to outlive a paused or long viewing
+# session, since the player does not re-fetch a finished (VOD) playlist
+HLS_PLAYLIST_SEGMENT_URL_EXPIRATION = 6 * 3600
+
+def get_s3_hls_playlist(s3_path: str, expiration: int = HLS_PLAYLIST_SEGMENT_URL_EXPIRATION) -> Optional[str]:
+    """
+    Fetch an HLS playlist from S3 with its segment entries rewritten to pre-signed URLs.
+    
+    The player then downloads segments straight from S3, instead of asking the API
+    for each one and being redirected.
+    
+    Args:
+        s3_path: Base S3 path in format bucket-name/object-key-prefix (without file name)
+        expiration: Expiration time in seconds of the segment URLs
+        
+    Returns:
+        Playlist text, or None if it could not be fetched or a segment URL could not be signed
+    """
+    try:
+        full_path = f"{s3_path}/playlist.m3u8"
+        bucket_name, object_key = parse_s3_path(full_path)
+        response = get_s3_client().get_object(Bucket=bucket_name, Key=object_key)
+        playlist = response['Body'].read().decode('utf-8')
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', '')
+        error_msg = e.response.get('Error', {}).get('Message', '')
+        logger.error(f"Failed to fetch HLS playlist from S3: {error_code} - {error_msg}")
+        return None
+    except Exception as e:
+        logger.error(f"Error fetching HLS playlist from S3: {str(e)}")
+        return None
+    
+    lines = []
+    for line in playlist.splitlines():
+        entry = line.strip()
+        # Tags and comments start with '#'; any other non-blank line is a segment URI
+        if entry and not entry.startswith('#') and '://' not in entry:
+            url = get_s3_hls_file_url(s3_path, entry, expiration=expiration)
+            if url is None:
+                return None
+            line = url
+        lines.append(line)
+    return "\n".join(lines) + "\n"
@@ -1,13 +1,26 @@
-import random
+import secrets
 import string
 
+STREAM_KEY_ALPHABET = string.ascii_letters + string.digits
+
+# Largest multiple of the alphabet size that fits in a byte; bytes at or above
+# it are discarded so every character stays equally likely
+_UNBIASED_BYTE_LIMIT = 256 - (256 % len(STREAM_KEY_ALPHABET))
+
 def generate_stream_key(length: int = 8) -> str:
     """Generate a random stream key of specified length."""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    # Draw random bytes in bulk rather than one secrets.choice call per character
+    chars = []
+    while len(chars) < length:
+        for byte in secrets.token_bytes(length * 2):
+            if byte < _UNBIASED_BYTE_LIMIT:
+                chars.append(STREAM_KEY_ALPHABET[byte % len(STREAM_KEY_ALPHABET)])
+                if len(chars) == length:
+                    break
+    return ''.join(chars)
 
 def validate_stream_key(stream_key: str) -> bool:
     """Validate that a stream key meets our requirements."""
     if not stream_key or len(stream_key) != 8:
         return False
-    return all(c in string.ascii_letters + string.digits for c in stream_key) 
\ No newline at end of file
+    return all(c in STREAM_KEY_ALPHABET for c in stream_key) 
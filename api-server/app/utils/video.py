@@ -2,18 +2,141 @@ import ffmpeg
 import os
 import tempfile
 import logging
+import shutil
 import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
+class _OutputDirLock:
+    """A lock together with the number of threads holding or waiting on it."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+# One lock per HLS output directory, so concurrent requests to process the same
+# recording run ffmpeg once. Entries only exist while some thread holds or waits
+# on them, so the dict does not grow with every recording ever processed.
+_output_dir_locks: Dict[str, _OutputDirLock] = {}
+_output_dir_locks_guard = threading.Lock()
+
+# Video info for already-packaged outputs, keyed by output directory and checked
+# against the playlist's mtime so re-packaging invalidates the entry
+PROCESSED_CACHE_TTL = 3600
+PROCESSED_CACHE_MAX_ENTRIES = 10000
+_processed_cache: Dict[str, Tuple[float, float, dict]] = {}
+
+# Render node through which the Intel media driver exposes Quick Sync
+QSV_RENDER_DEVICE = "/dev/dri/renderD128"
+
+@lru_cache(maxsize=None)
+def get_h264_encoder() -> str:
+    """
+    Pick the H.264 encoder for ffmpeg, detected once per process.
+    
+    Uses NVENC when an NVIDIA GPU is present, then Quick Sync when an Intel
+    render node is present, provided the ffmpeg build supports the encoder.
+    Otherwise falls back to libx264.
+    """
+    has_nvidia = shutil.which("nvidia-smi") is not None
+    has_qsv_device = os.path.exists(QSV_RENDER_DEVICE)
+    if has_nvidia or has_qsv_device:
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-encoders"],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+            if has_nvidia and "h264_nvenc" in result.stdout:
+                logger.info("Using h264_nvenc for video encoding")
+                return "h264_nvenc"
+            if has_qsv_device and "h264_qsv" in result.stdout:
+                logger.info("Using h264_qsv for video encoding")
+                return "h264_qsv"
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not query ffmpeg encoders: {str(e)}")
+    return "libx264"
+
+def get_hwaccel_args() -> List[str]:
+    """
+    ffmpeg input options that decode on the GPU when encoding on it.
+    
+    Decoded frames are copied back to system memory, so CPU filters such as
+    split and scale keep working; only the decode itself moves off the CPU.
+    """
+    encoder = get_h264_encoder()
+    if encoder == "h264_nvenc":
+        return ["-hwaccel", "cuda"]
+    if encoder == "h264_qsv":
+        return ["-hwaccel", "qsv"]
+    return []
+
+def get_h264_quality_args(crf: int = 23, preset: str = "fast") -> List[str]:
+    """Constant-quality H.264 encoder options for whichever encoder get_h264_encoder picked."""
+    encoder = get_h264_encoder()
+    if encoder == "h264_nvenc":
+        # NVENC has no CRF; VBR with a constant quality target is the equivalent
+        return ["-c:v", encoder, "-preset", "p4", "-rc", "vbr", "-cq", str(crf), "-b:v", "0"]
+    if encoder == "h264_qsv":
+        # ICQ mode; global_quality is on roughly the same scale as CRF
+        return ["-c:v", encoder, "-preset", preset, "-global_quality", str(crf)]
+    return ["-c:v", encoder, "-preset", preset, "-crf", str(crf)]
+
+def get_h264_bitrate_args(bitrate: str, preset: str = "medium") -> List[str]:
+    """
+    Constant-bitrate H.264 encoder options for an adaptive bitrate rendition.
+    
+    bitrate is an ffmpeg bitrate in kilobits such as "800k"; the VBV buffer is
+    twice the bitrate.
+    """
+    encoder = get_h264_encoder()
+    rate_args = ["-b:v", bitrate, "-maxrate", bitrate, "-bufsize", f"{int(bitrate[:-1]) * 2}k"]
+    if encoder == "h264_nvenc":
+        return ["-c:v", encoder, "-preset", "p4", "-rc", "cbr", *rate_args]
+    return ["-c:v", encoder, "-preset", preset, *rate_args]
+
+def is_remote_input(input_file: str) -> bool:
+    """Whether input_file is an HTTP(S) URL that ffmpeg reads over the network."""
+    return input_file.startswith(("http://", "https://"))
+
+def describe_input(input_file: str) -> str:
+    """input_file for log messages, with any URL query string (e.g. a pre-signed signature) removed."""
+    return input_file.split("?", 1)[0] if is_remote_input(input_file) else input_file
+
+def get_input_args(input_file: str) -> List[str]:
+    """ffmpeg options placed before -i for input_file."""
+    if is_remote_input(input_file):
+        # Resume the HTTP read if the connection drops part way through a transcode
+        return ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
+    return []
+
+def check_input_file(input_file: str) -> None:
+    """Raise if a local input file is missing or unreadable. URLs are checked by ffprobe instead."""
+    if is_remote_input(input_file):
+        return
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(f"Input file not found: {input_file}")
+    if not os.access(input_file, os.R_OK):
+        raise PermissionError(f"Input file is not readable: {input_file}")
+
 def ensure_directory(directory: str) -> None:
     """Ensure a directory exists and is writable."""
     Path(directory).mkdir(parents=True, exist_ok=True)
     if not os.access(directory, os.W_OK):
         raise PermissionError(f"Directory is not writable: {directory}")
 
+# Players start playback once the first segment has downloaded, so the opening
+# segments are kept short; keyframes every KEYFRAME_INTERVAL seconds let ffmpeg cut
+# segments exactly on the requested boundaries.
+INITIAL_SEGMENT_DURATION = 2
+KEYFRAME_INTERVAL = 2
+
 def create_hls_playlist(input_file: str, output_dir: str, segment_duration: int = 6) -> str:
     """
     Create an HLS playlist from an input video file.
@@ -26,46 +149,51 @@ def create_hls_playlist(input_file: str, output_dir: str, segment_duration: int
     Returns:
         Path to the HLS playlist file
     """
+    partial_playlist_path = None
     try:
         ensure_directory(output_dir)
         
         # First verify the input file exists and is readable
-        if not os.path.exists(input_file):
-            raise FileNotFoundError(f"Input file not found: {input_file}")
-        if not os.access(input_file, os.R_OK):
-            raise PermissionError(f"Input file is not readable: {input_file}")
+        check_input_file(input_file)
 
         # Get video info first to verify the file is valid
         probe = ffmpeg.probe(input_file)
         video_info = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
         if not video_info:
-            raise ValueError(f"No video stream found in file: {input_file}")
+            raise ValueError(f"No video stream found in file: {describe_input(input_file)}")
 
-        logger.info(f"Processing video file: {input_file}")
+        logger.info(f"Processing video file: {describe_input(input_file)}")
         logger.info(f"Video info: {video_info}")
         
         playlist_path = os.path.join(output_dir, "playlist.m3u8")
         segment_pattern = os.path.join(output_dir, "segment_%03d.ts")
+        # ffmpeg rewrites the playlist after every segment, so it writes to a temporary
+        # name and playlist.m3u8 only appears once the whole recording is packaged.
+        # A run that fails part way through then never looks like a finished one.
+        partial_playlist_path = os.path.join(output_dir, "playlist.partial.m3u8")
 
         # Start with a simple single-quality HLS conversion
         command = [
             "ffmpeg",
             "-y",  # Overwrite output files
+            *get_hwaccel_args(),   # GPU decode when encoding with NVENC
+            *get_input_args(input_file),
             "-i", input_file,
-            "-c:v", "libx264",     # Video codec
-            "-preset", "fast",      # Encoding preset
-            "-crf", "23",          # Quality level
+            *get_h264_quality_args(crf=23, preset="fast"),  # Video codec, preset and quality level
+            "-force_key_frames", f"expr:gte(t,n_forced*{KEYFRAME_INTERVAL})",  # Segment-aligned keyframes
             "-c:a", "aac",         # Audio codec
             "-b:a", "128k",        # Audio bitrate
             "-ac", "2",            # Audio channels
             "-f", "hls",
+            "-hls_init_time", str(INITIAL_SEGMENT_DURATION),  # Short opening segments for fast startup
             "-hls_time", str(segment_duration),
+            "-hls_flags", "independent_segments",  # Every segment starts on a keyframe
             "-hls_list_size", "0", # Keep all segments
             "-hls_segment_filename", segment_pattern,
-            playlist_path
+            partial_playlist_path
         ]
         
-        logger.info(f"Running ffmpeg command: {' '.join(command)}")
+        logger.info(f"Running ffmpeg command: {' '.join(command).replace(input_file, describe_input(input_file))}")
         
         # Run ffmpeg with output capture
         result = subprocess.run(
@@ -79,20 +207,52 @@ def create_hls_playlist(input_file: str, output_dir: str, segment_duration: int
             logger.error(f"ffmpeg conversion failed with output:\n{result.stderr}")
             raise RuntimeError(f"ffmpeg conversion failed: {result.stderr}")
             
-        if not os.path.exists(playlist_path):
-            raise FileNotFoundError(f"HLS playlist was not created at: {playlist_path}")
+        if not os.path.exists(partial_playlist_path):
+            raise FileNotFoundError(f"HLS playlist was not created at: {partial_playlist_path}")
+        os.replace(partial_playlist_path, playlist_path)
             
         logger.info(f"Successfully created HLS playlist at: {playlist_path}")
         return playlist_path
         
     except Exception as e:
         logger.error(f"Error creating HLS playlist: {str(e)}")
+        if partial_playlist_path and os.path.exists(partial_playlist_path):
+            os.remove(partial_playlist_path)
         raise
 
+def _probe_video_info(file_path: str, size: Optional[int] = None) -> dict:
+    """Run ffprobe on file_path and summarize its video stream, or return {} if it has none."""
+    probe = ffmpeg.probe(file_path)
+    video_info = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+    if not video_info:
+        return {}
+    return {
+        'width': int(video_info.get('width', 0)),
+        'height': int(video_info.get('height', 0)),
+        'duration': float(probe.get('format', {}).get('duration', 0)),
+        'bitrate': int(probe.get('format', {}).get('bit_rate', 0)),
+        'format': probe.get('format', {}).get('format_name', ''),
+        'codec': video_info.get('codec_name', ''),
+        'size': size if size is not None else int(probe.get('format', {}).get('size', 0))
+    }
+
+@lru_cache(maxsize=4096)
+def _cached_video_info(file_path: str, mtime_ns: int, size: int) -> dict:
+    """
+    Memoized _probe_video_info for local files.
+    
+    The modification time and size are part of the key, so a file that is
+    rewritten in place is probed again rather than served stale info.
+    """
+    return _probe_video_info(file_path, size)
+
 def get_video_info(file_path: str) -> dict:
     """
     Get information about a video file.
     
+    Local files are probed once per version of the file; recordings are not
+    modified after they are written, so repeat calls skip the ffprobe run.
+    
     Args:
         file_path: Path to the video file
         
@@ -100,64 +260,83 @@ def get_video_info(file_path: str) -> dict:
         Dictionary with video information
     """
     try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"Video file not found: {file_path}")
-            
-        probe = ffmpeg.probe(file_path)
-        video_info = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+        if is_remote_input(file_path):
+            info = _probe_video_info(file_path)
+        else:
+            try:
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Video file not found: {file_path}")
+            # Copy so callers cannot modify the cached entry
+            info = dict(_cached_video_info(file_path, stat_result.st_mtime_ns, stat_result.st_size))
         
-        if video_info:
-            info = {
-                'width': int(video_info.get('width', 0)),
-                'height': int(video_info.get('height', 0)),
-                'duration': float(probe.get('format', {}).get('duration', 0)),
-                'bitrate': int(probe.get('format', {}).get('bit_rate', 0)),
-                'format': probe.get('format', {}).get('format_name', ''),
-                'codec': video_info.get('codec_name', ''),
-                'size': os.path.getsize(file_path)
-            }
+        if info:
             logger.info(f"Retrieved video info: {info}")
-            return info
-        return {}
+        return info
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
         return {}
 
+@contextmanager
+def _locked_output_dir(output_dir: str):
+    """Hold the lock serializing HLS processing into output_dir."""
+    with _output_dir_locks_guard:
+        entry = _output_dir_locks.get(output_dir)
+        if entry is None:
+            entry = _output_dir_locks[output_dir] = _OutputDirLock()
+        entry.users += 1
+    try:
+        with entry.lock:
+            yield
+    finally:
+        with _output_dir_locks_guard:
+            entry.users -= 1
+            if entry.users == 0:
+                del _output_dir_locks[output_dir]
+
 def process_video_for_streaming(input_file: str, output_dir: str) -> Tuple[str, dict]:
     """
     Process a video file for streaming by converting to HLS format.
     
     Args:
-        input_file: Path to the input video file
+        input_file: Path to the input video file, or an HTTP(S) URL such as a
+            pre-signed S3 URL
         output_dir: Directory to store the processed files
         
     Returns:
         Tuple of (playlist_path, video_info)
     """
     try:
-        # First check if HLS version already exists
-        playlist_path = os.path.join(output_dir, "playlist.m3u8")
-        if os.path.exists(playlist_path):
-            logger.info(f"HLS playlist already exists at: {playlist_path}")
-            return playlist_path, get_video_info(input_file)
+        with _locked_output_dir(output_dir):
+            # First check if HLS version already exists
+            playlist_path = os.path.join(output_dir, "playlist.m3u8")
+            if os.path.exists(playlist_path):
+                playlist_mtime = os.path.getmtime(playlist_path)
+                cached = _processed_cache.get(output_dir)
+                if cached is not None and cached[0] > time.monotonic() and cached[1] == playlist_mtime:
+                    return playlist_path, cached[2]
+                
+                logger.info(f"HLS playlist already exists at: {playlist_path}")
+                video_info = get_video_info(input_file)
+            else:
+                # Ensure input file exists and is readable
+                check_input_file(input_file)
+                    
+                # Get video information
+                logger.info(f"Getting video info for: {describe_input(input_file)}")
+                video_info = get_video_info(input_file)
+                if not video_info:
+                    raise ValueError(f"Could not get video information from: {describe_input(input_file)}")
+                    
+                # Create HLS playlist
+                logger.info(f"Creating HLS playlist in: {output_dir}")
+                playlist_path = create_hls_playlist(input_file, output_dir)
+                playlist_mtime = os.path.getmtime(playlist_path)
             
-        # Ensure input file exists and is readable
-        if not os.path.exists(input_file):
-            raise FileNotFoundError(f"Input file not found: {input_file}")
-        if not os.access(input_file, os.R_OK):
-            raise PermissionError(f"Input file is not readable: {input_file}")
-            
-        # Get video information
-        logger.info(f"Getting video info for: {input_file}")
-        video_info = get_video_info(input_file)
-        if not video_info:
-            raise ValueError(f"Could not get video information from: {input_file}")
-            
-        # Create HLS playlist
-        logger.info(f"Creating HLS playlist in: {output_dir}")
-        playlist_path = create_hls_playlist(input_file, output_dir)
-        
-        return playlist_path, video_info
+            if len(_processed_cache) >= PROCESSED_CACHE_MAX_ENTRIES:
+                _processed_cache.clear()
+            _processed_cache[output_dir] = (time.monotonic() + PROCESSED_CACHE_TTL, playlist_mtime, video_info)
+            return playlist_path, video_info
     except Exception as e:
         logger.error(f"Error processing video for streaming: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
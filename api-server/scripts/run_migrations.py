@@ -57,20 +57,21 @@ if not test_db_connection():
 # Try to run Alembic migrations first
 try:
     print("Attempting to run Alembic migrations...")
-    import subprocess
-    result = subprocess.run(
-        ["alembic", "upgrade", "head"],
-        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-        check=False,  # Don't raise an exception on non-zero exit
-        capture_output=True,
-        text=True
-    )
+    # Run in-process on the app engine rather than shelling out to the alembic CLI,
+    # which would start a second interpreter and re-import everything
+    from alembic import command
+    from alembic.config import Config
+    from app.database import engine
     
-    if result.returncode == 0:
-        print(result.stdout)
-        print("Alembic migrations completed successfully.")
-        sys.exit(0)
-    else:
-        print(f"Alembic migrations failed: {result.stderr}")
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    alembic_cfg = Config(os.path.join(project_dir, "alembic.ini"))
+    # script_location in alembic.ini is relative, so pin it to the project directory
+    alembic_cfg.set_main_option("script_location", os.path.join(project_dir, "alembic"))
+    with engine.connect() as connection:
+        alembic_cfg.attributes['connection'] = connection
+        command.upgrade(alembic_cfg, "head")
+    
+    print("Alembic migrations completed successfully.")
+    sys.exit(0)
 except Exception as e:
     print(f"Error running Alembic: {e}")
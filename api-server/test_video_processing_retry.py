@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests that a transcode which fails part way through is never reported as completed,
+neither on the automatic retry nor afterwards.
+ffmpeg and the database are replaced with fakes, so no video or Postgres is needed.
+"""
+
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+# The app modules import these at module level
+for module in ("ffmpeg", "dotenv", "boto3", "requests", "psycopg", "greenlet"):
+    pytest.importorskip(module)
+
+from app.services import video_processor
+from app.utils import video
+
+RECORDING_ID = 42
+
+class FakeQuery:
+    def __init__(self, recording):
+        self.recording = recording
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return self.recording
+
+class FakeSession:
+    def __init__(self, recording):
+        self.recording = recording
+
+    def query(self, model):
+        return FakeQuery(self.recording)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeFfmpeg:
+    """Stands in for subprocess.run; fails the first `failures` transcodes after writing part of the playlist."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, command, **kwargs):
+        self.calls += 1
+        output_playlist = command[-1]
+        with open(output_playlist, "w") as f:
+            f.write("#EXTM3U\n#EXTINF:2.0,\nsegment_000.ts\n")
+        if self.calls <= self.failures:
+            return subprocess.CompletedProcess(command, 1, "", "Connection reset by peer")
+        with open(output_playlist, "a") as f:
+            f.write("#EXT-X-ENDLIST\n")
+        return subprocess.CompletedProcess(command, 0, "", "")
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    recordings_dir = tmp_path / "recordings"
+    recordings_dir.mkdir()
+    mp4_path = recordings_dir / "stream.mp4"
+    mp4_path.write_bytes(b"not really a video")
+
+    monkeypatch.setattr(video_processor, "RECORDINGS_DIR", str(recordings_dir))
+    monkeypatch.setattr(video_processor, "HLS_DIR", str(recordings_dir / "hls"))
+    monkeypatch.setattr(video_processor, "PROCESSING_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(video_processor, "PROCESSING_MAX_ATTEMPTS", 2)
+
+    recording = SimpleNamespace(
+        id=RECORDING_ID,
+        environment="local",
+        local_mp4_path=str(mp4_path),
+        local_hls_path=None,
+        recording_metadata={}
+    )
+    monkeypatch.setattr(video_processor, "get_db_session", lambda: FakeSession(recording))
+
+    def fake_update_transcoding_status(db, recording_id, status, error_message=None):
+        recording.recording_metadata = {**recording.recording_metadata, "transcoding_status": status}
+    monkeypatch.setattr(video_processor, "update_transcoding_status", fake_update_transcoding_status)
+
+    probe = {
+        "streams": [{"codec_type": "video", "width": 1280, "height": 720, "codec_name": "h264"}],
+        "format": {"duration": "4.0", "bit_rate": "1000", "format_name": "mp4", "size": "18"}
+    }
+    monkeypatch.setattr(video.ffmpeg, "probe", lambda path: probe)
+    monkeypatch.setattr(video, "get_h264_encoder", lambda: "libx264")
+    video._processed_cache.clear()
+    video._cached_video_info.cache_clear()
+    video_processor.active_tasks.pop(RECORDING_ID, None)
+    return recording
+
+def test_failed_transcode_is_not_reported_completed(recording, monkeypatch):
+    fake_ffmpeg = FakeFfmpeg(failures=2)
+    monkeypatch.setattr(video.subprocess, "run", fake_ffmpeg)
+
+    video_processor.run_processing_job(RECORDING_ID)
+
+    # Both attempts really ran ffmpeg; the retry did not pick up the first one's output
+    assert fake_ffmpeg.calls == 2
+    assert video_processor.active_tasks[RECORDING_ID]["status"] == "failed"
+    assert recording.recording_metadata["transcoding_status"] == "failed"
+    assert not os.path.exists(os.path.join(video_processor.HLS_DIR, str(RECORDING_ID), "playlist.m3u8"))
+
+def test_retry_after_failed_transcode_packages_again(recording, monkeypatch):
+    fake_ffmpeg = FakeFfmpeg(failures=1)
+    monkeypatch.setattr(video.subprocess, "run", fake_ffmpeg)
+
+    video_processor.run_processing_job(RECORDING_ID)
+
+    assert fake_ffmpeg.calls == 2
+    assert video_processor.active_tasks[RECORDING_ID]["status"] == "completed"
+    assert recording.recording_metadata["transcoding_status"] == "completed"
+    with open(os.path.join(video_processor.HLS_DIR, str(RECORDING_ID), "playlist.m3u8")) as f:
+        assert f.read().endswith("#EXT-X-ENDLIST\n")
@@ -169,6 +169,8 @@ convert_to_hls_async() {
     local output_dir="$2"
     local status_file="$3"
     local segment_duration=6  # Duration of each segment in seconds
+    local initial_segment_duration=2  # Short opening segments so playback starts sooner
+    local keyframe_interval=2  # Keyframes on segment boundaries so segments are cut exactly
     
     # Ensure output directory exists
     mkdir -p "$output_dir"
@@ -185,12 +187,14 @@ convert_to_hls_async() {
     # Run ffmpeg to convert to HLS with optimized settings for streaming
     if ffmpeg -y -i "$input_file" \
         -c:v libx264 -preset fast -crf 23 \
+        -force_key_frames "expr:gte(t,n_forced*$keyframe_interval)" \
         -c:a aac -b:a 128k -ac 2 \
         -f hls \
+        -hls_init_time "$initial_segment_duration" \
         -hls_time "$segment_duration" \
         -hls_list_size 0 \
         -hls_segment_filename "$segment_pattern" \
-        -hls_flags delete_segments+append_list \
+        -hls_flags delete_segments+append_list+independent_segments \
         "$playlist_path" >> /var/log/nginx/recording.log 2>&1; then
         
         echo "$(date): [ASYNC] HLS conversion successful" >> /var/log/nginx/recording.log